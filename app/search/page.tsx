@@ -3,11 +3,34 @@
 import HadithList from "@/components/hadith-list";
 import { LoadingSpinner } from "@/components/loading-spinner";
 import { arabicTexts, toArabicNumerals } from "@/lib/arabic-utils";
-import { normalizeForSearch } from "@/lib/search-utils";
+import {
+  candidateIds,
+  normalizeForSearch,
+  type ShardPostings,
+} from "@/lib/search-utils";
 import type { HadithWithFirstNarrator } from "@/lib/sqlite";
 import { useDeferredValue, useEffect, useRef, useState } from "react";
 
 const SOURCES = ["Sahih Bukhari", "Sahih Muslim"];
+const basePath = process.env.NEXT_PUBLIC_BASE_PATH || "";
+
+// An entry of public/search/manifest.json, written by gen_search_index
+interface SearchShard {
+  source: string;
+  chapter: string;
+  count: number;
+  bytes: number;
+  file: string;
+  postings_bytes: number;
+  postings: string;
+}
+
+// Hadiths matching a text query, computed for one set of loaded shards
+interface TextMatches {
+  query: string;
+  hadiths: HadithWithFirstNarrator[];
+  matches: Set<HadithWithFirstNarrator>;
+}
 
 function useDebouncedValue<T>(value: T, delay: number) {
   const [debouncedValue, setDebouncedValue] = useState(value);
@@ -38,41 +61,122 @@ export default function SearchPage() {
   const [page, setPage] = useState(0);
   const limit = 30;
   const [initializing, setInitializing] = useState(true);
+  const [shards, setShards] = useState<SearchShard[]>([]);
+  const [fetchingShards, setFetchingShards] = useState(false);
+  const [loadedShards, setLoadedShards] = useState<
+    { shard: SearchShard; hadiths: HadithWithFirstNarrator[] }[]
+  >([]);
+  const [textMatches, setTextMatches] = useState<TextMatches | null>(null);
+  // Shard files are content-hashed, so each one is fetched at most once
+  const shardCache = useRef(
+    new Map<string, Promise<HadithWithFirstNarrator[]>>(),
+  );
+  const postingsCache = useRef(new Map<string, Promise<ShardPostings>>());
 
   // For chapter dropdown
   const [chapters, setChapters] = useState<string[]>([]);
   useEffect(() => {
-    // Extract chapters from allHadiths for the selected source
-    const chs = Array.from(
-      new Set(
-        allHadiths.filter((h) => h.source === source).map((h) => h.chapter),
-      ),
+    // The manifest lists the chapters of each source in order
+    setChapters(
+      shards.filter((s) => s.source === source).map((s) => s.chapter),
     );
-    setChapters(chs);
-  }, [source, allHadiths]);
+  }, [source, shards]);
 
-  // Load hadiths.json once
+  // Load the shard manifest once
   useEffect(() => {
-    setLoading(true);
     setInitializing(true);
-    const basePath = process.env.NEXT_PUBLIC_BASE_PATH || "";
-    fetch(`${basePath}/search_index.json`)
+    // The manifest is the only file whose name doesn't change with its content,
+    // so revalidate it; the shards it lists are cached as they are
+    fetch(`${basePath}/search/manifest.json`, { cache: "no-cache" })
       .then((res) => res.json())
       .then((data) => {
-        setAllHadiths(data);
-        setLoading(false);
+        setShards(data.shards);
         setInitializing(false);
       });
   }, []);
 
+  // Load only the shards the source and chapter filters select
+  useEffect(() => {
+    if (shards.length === 0) return;
+    let cancelled = false;
+    const selected = shards.filter(
+      (s) => s.source === source && (!chapter || s.chapter === chapter),
+    );
+    const cache = shardCache.current;
+    setFetchingShards(true);
+    Promise.all(
+      selected.map((s) => {
+        if (!cache.has(s.file)) {
+          cache.set(
+            s.file,
+            fetch(`${basePath}/search/${s.file}`).then((res) => res.json()),
+          );
+        }
+        return cache.get(s.file)!;
+      }),
+    ).then((parts) => {
+      if (cancelled) return;
+      setLoadedShards(
+        selected.map((shard, i) => ({ shard, hadiths: parts[i] })),
+      );
+      setAllHadiths(parts.flat());
+      setFetchingShards(false);
+    });
+    return () => {
+      cancelled = true;
+    };
+  }, [shards, source, chapter]);
+
   // Debounced and deferred search
   const deferredText = useDeferredValue(text);
   const debouncedText = useDebouncedValue(deferredText, 500);
   const deferredNarrator = useDeferredValue(narrator);
   const debouncedNarrator = useDebouncedValue(deferredNarrator, 500);
+  const normText = debouncedText ? normalizeForSearch(debouncedText) : "";
+  // Text matches lag a query or shard change while postings are fetched
+  const matchingText =
+    !!debouncedText &&
+    (textMatches === null ||
+      textMatches.query !== normText ||
+      textMatches.hadiths !== allHadiths);
+
+  // Match the text query through the postings of the loaded shards, fetched
+  // on the first text query, and check only the candidates they return
+  useEffect(() => {
+    if (!debouncedText) return;
+    let cancelled = false;
+    const cache = postingsCache.current;
+    Promise.all(
+      loadedShards.map(({ shard }) => {
+        if (!cache.has(shard.postings)) {
+          cache.set(
+            shard.postings,
+            fetch(`${basePath}/search/${shard.postings}`).then((res) =>
+              res.json(),
+            ),
+          );
+        }
+        return cache.get(shard.postings)!;
+      }),
+    ).then((postings) => {
+      if (cancelled) return;
+      const matches = new Set<HadithWithFirstNarrator>();
+      loadedShards.forEach(({ hadiths }, i) => {
+        for (const id of candidateIds(postings[i], normText)) {
+          // text_ar is normalized by gen_search_index already
+          if (hadiths[id].text_ar?.includes(normText)) matches.add(hadiths[id]);
+        }
+      });
+      setTextMatches({ query: normText, hadiths: allHadiths, matches });
+    });
+    return () => {
+      cancelled = true;
+    };
+  }, [debouncedText, normText, loadedShards, allHadiths]);
 
   // Filter hadiths client-side (robust: normalize whitespace & strip diacritics)
   useEffect(() => {
+    if (matchingText) return;
     setLoading(true);
     setPage(0);
     setHasMore(true);
@@ -87,11 +191,8 @@ export default function SearchPage() {
           normalizeForSearch(h.narrator_name).includes(normNarr),
       );
     }
-    if (debouncedText) {
-      const normText = normalizeForSearch(debouncedText);
-      filtered = filtered.filter(
-        (h) => h.text_ar && normalizeForSearch(h.text_ar).includes(normText),
-      );
+    if (debouncedText && textMatches) {
+      filtered = filtered.filter((h) => textMatches.matches.has(h));
     }
 
     // Set the total count and initial results
@@ -99,7 +200,15 @@ export default function SearchPage() {
     setResults(filtered.slice(0, limit));
     setHasMore(filtered.length > limit);
     setLoading(false);
-  }, [allHadiths, debouncedText, source, chapter, debouncedNarrator]);
+  }, [
+    allHadiths,
+    debouncedText,
+    textMatches,
+    matchingText,
+    source,
+    chapter,
+    debouncedNarrator,
+  ]);
 
   // Infinite scroll (with robust normalization)
   const loaderRef = useRef<HTMLDivElement>(null);
@@ -119,12 +228,8 @@ export default function SearchPage() {
               normalizeForSearch(h.narrator_name).includes(normNarr),
           );
         }
-        if (debouncedText) {
-          const normText = normalizeForSearch(debouncedText);
-          filtered = filtered.filter(
-            (h) =>
-              h.text_ar && normalizeForSearch(h.text_ar).includes(normText),
-          );
+        if (debouncedText && textMatches) {
+          filtered = filtered.filter((h) => textMatches.matches.has(h));
         }
         const next = filtered.slice((page + 1) * limit, (page + 2) * limit);
         setResults((prev) => [...prev, ...next]);
@@ -140,6 +245,7 @@ export default function SearchPage() {
     loading,
     allHadiths,
     debouncedText,
+    textMatches,
     source,
     chapter,
     debouncedNarrator,
@@ -232,7 +338,7 @@ export default function SearchPage() {
           {/* Results Info integrated into the search card */}
           <div className="mt-4 border-t-2 border-black bg-parchment px-4 py-2">
             <div className="text-right text-sm font-bold">
-              {loading ? (
+              {loading || fetchingShards || matchingText ? (
                 <span>🔍 {arabicTexts.searching}</span>
               ) : (
                 <span>
@@ -265,7 +371,7 @@ export default function SearchPage() {
       )}
 
       {/* No results state with brutalist styling */}
-      {!loading && totalCount === 0 && (
+      {!loading && !fetchingShards && !matchingText && totalCount === 0 && (
         <div className="py-8 text-center">
           <div className="inline-block border-4 border-black bg-white px-8 py-6">
             <div className="text-2xl font-bold text-gray-700">🔍</div>
@@ -28,7 +28,8 @@ export default function HadithCard({
         <div className="absolute left-0 top-0 z-10 h-24 w-24 -translate-x-12 -translate-y-12 -rotate-45 transform bg-parchment"></div>
         <div className="absolute left-2 top-2 z-20 rotate-45 transform">
           <div className="-rotate-90 transform bg-black px-2 py-1 text-xl font-bold text-parchment">
-            {toArabicNumerals(hadith.id)}
+            {/* Search index records have no row id, which changes between builds */}
+            {toArabicNumerals(hadith.id ?? hadith.hadith_no)}
           </div>
         </div>
         <div className="p-6 pl-16 pt-10">
@@ -18,3 +18,69 @@ export function normalizeWhitespace(str: string): string {
 export function normalizeForSearch(text: string): string {
   return normalizeWhitespace(stripDiacritics(text));
 }
+
+// Postings of one search shard, written by gen_search_index: ids are positions
+// in the shard, stored as ascending gaps
+export interface ShardPostings {
+  tokens: Record<string, number[]>;
+  trigrams: Record<string, number[]>;
+}
+
+export function decodePostings(deltas: number[]): number[] {
+  const ids = new Array<number>(deltas.length);
+  let id = 0;
+  for (let i = 0; i < deltas.length; i++) {
+    id += deltas[i];
+    ids[i] = id;
+  }
+  return ids;
+}
+
+function intersectSorted(a: number[], b: number[]): number[] {
+  const out: number[] = [];
+  let i = 0;
+  let j = 0;
+  while (i < a.length && j < b.length) {
+    if (a[i] < b[j]) i++;
+    else if (a[i] > b[j]) j++;
+    else {
+      out.push(a[i]);
+      i++;
+      j++;
+    }
+  }
+  return out;
+}
+
+// Ids of the hadiths in a shard that may contain a normalized query. Postings
+// only show that the query's trigrams (or a token containing it) occur, so the
+// caller still checks the text of each candidate.
+export function candidateIds(
+  postings: ShardPostings,
+  query: string,
+): number[] {
+  if (query.length >= 3) {
+    const lists: number[][] = [];
+    const grams = new Set<string>();
+    for (let i = 0; i + 3 <= query.length; i++) {
+      grams.add(query.slice(i, i + 3));
+    }
+    for (const gram of grams) {
+      const deltas = postings.trigrams[gram];
+      if (!deltas) return [];
+      lists.push(decodePostings(deltas));
+    }
+    // Start from the rarest trigram so every intersection stays small
+    lists.sort((a, b) => a.length - b.length);
+    return lists.reduce(intersectSorted);
+  }
+
+  // Too short for a trigram: union the postings of the tokens containing it
+  const ids = new Set<number>();
+  for (const [token, deltas] of Object.entries(postings.tokens)) {
+    if (token.includes(query)) {
+      for (const id of decodePostings(deltas)) ids.add(id);
+    }
+  }
+  return [...ids].sort((a, b) => a - b);
+}
@@ -1,3 +1,4 @@
+import { normalizeForSearch } from "./search-utils";
 import { Database } from "bun:sqlite";
 
 export interface Hadith {
@@ -10,6 +11,7 @@ export interface Hadith {
   text_ar: string;
   text_en: string;
   explanation: string;
+  chain: string | null;
 }
 
 export interface Narrator {
@@ -56,6 +58,8 @@ export interface NarratorPair {
   hadith_count: number;
 }
 
+export type HadithSearchResult = Hadith & { snippet: string; rank: number };
+
 export interface Chapter {
   source: string;
   chapter: string;
@@ -86,11 +90,14 @@ let statements: {
   getNarratorsWithHadiths?: ReturnType<Database["prepare"]>;
   getHadithsFromNarratorToNarrator?: ReturnType<Database["prepare"]>;
   getNarratorPairs?: ReturnType<Database["prepare"]>;
+  searchHadiths?: ReturnType<Database["prepare"]>;
 } = {};
 
 function getDb() {
   if (!db) {
-    db = new Database("data/sqlite.db");
+    // The app never writes; gen_db --publish compacts the file for read-only use
+    db = new Database("data/sqlite.db", { readonly: true });
+    db.exec("PRAGMA mmap_size = 268435456");
     // Prepare statements
     statements.getHadiths = db.prepare(
       "SELECT * FROM hadiths ORDER BY id LIMIT $limit",
@@ -103,15 +110,14 @@ function getDb() {
     statements.getHadithById = db.prepare(`
             SELECT * FROM hadiths
             WHERE source = $source AND chapter = $chapter AND hadith_no = $hadith_no`);
+    // One read of the hadith row, then rawis lookups for its packed chain
     statements.getChainForHadith = db.prepare(`
-            SELECT c.*, r.*
-            FROM hadith_chains c
-            JOIN rawis r ON c.scholar_indx = r.scholar_indx
-            JOIN hadiths h ON c.source = h.source
-                AND c.chapter_no = h.chapter_no
-                AND c.hadith_no = h.hadith_no
-            WHERE c.source = $source AND h.chapter = $chapter AND c.hadith_no = $hadith_no
-            ORDER BY c.position`);
+            SELECT h.source, h.chapter_no, h.hadith_no, j.value AS scholar_indx,
+                j.key + 1 AS position, r.*
+            FROM hadiths h, json_each(h.chain) j
+            JOIN rawis r ON r.scholar_indx = j.value
+            WHERE h.source = $source AND h.chapter = $chapter AND h.hadith_no = $hadith_no
+            ORDER BY h.id, j.key`);
     statements.getHadithsBySource = db.prepare(`
       SELECT h.*, r.name as narrator_name
       FROM hadiths h
@@ -128,30 +134,20 @@ function getDb() {
       WHERE name = $name
     `);
     statements.getSuccessors = db.prepare(`
-      SELECT DISTINCT r.*
-      FROM hadith_chains c1
-      JOIN hadith_chains c2 ON
-        c1.source = c2.source AND
-        c1.chapter_no = c2.chapter_no AND
-        c1.hadith_no = c2.hadith_no AND
-        c1.position = c2.position - 1
-      JOIN rawis r ON c2.scholar_indx = r.scholar_indx
-      WHERE c1.scholar_indx = $scholar_indx
-      AND c1.source = $source
+      SELECT r.*
+      FROM narrator_edges e
+      JOIN rawis r ON e.to_indx = r.scholar_indx
+      WHERE e.from_indx = $scholar_indx
+      AND e.source = $source
       ORDER BY r.name
     `);
 
     statements.getPredecessors = db.prepare(`
-      SELECT DISTINCT r.*
-      FROM hadith_chains c1
-      JOIN hadith_chains c2 ON
-        c1.source = c2.source AND
-        c1.chapter_no = c2.chapter_no AND
-        c1.hadith_no = c2.hadith_no AND
-        c1.position = c2.position + 1
-      JOIN rawis r ON c2.scholar_indx = r.scholar_indx
-      WHERE c1.scholar_indx = $scholar_indx
-      AND c1.source = $source
+      SELECT r.*
+      FROM narrator_edges e
+      JOIN rawis r ON e.from_indx = r.scholar_indx
+      WHERE e.to_indx = $scholar_indx
+      AND e.source = $source
       ORDER BY r.name
     `);
     statements.getNarratorsInSource = db.prepare(`
@@ -167,15 +163,11 @@ function getDb() {
       ORDER BY LENGTH(content) DESC
     `);
     statements.getNarratorChapters = db.prepare(`
-      SELECT h.source, h.chapter, COUNT(DISTINCT h.hadith_no) as count
-      FROM hadith_chains c
-      JOIN hadiths h ON c.source = h.source
-          AND c.chapter_no = h.chapter_no
-          AND c.hadith_no = h.hadith_no
-      WHERE c.scholar_indx = $scholar_indx
-      AND c.source = $source
-      GROUP BY h.source, h.chapter, h.chapter_no
-      ORDER BY h.source ASC, h.chapter_no ASC`);
+      SELECT source, chapter, count
+      FROM narrator_chapter_stats
+      WHERE scholar_indx = $scholar_indx
+      AND source = $source
+      ORDER BY source ASC, chapter_no ASC`);
     statements.getHadithsByChapter = db.prepare(`
       SELECT h.*, r.name as narrator_name
       FROM hadiths h
@@ -187,10 +179,9 @@ function getDb() {
       WHERE h.source = $source AND h.chapter = $chapter
       ORDER BY h.chapter_no, h.hadith_no`);
     statements.getSourceChapters = db.prepare(`
-      SELECT source, chapter, chapter_no, COUNT(*) as count
-      FROM hadiths
+      SELECT source, chapter, chapter_no, count
+      FROM chapter_stats
       WHERE source = $source
-      GROUP BY source, chapter, chapter_no
       ORDER BY chapter_no ASC
     `);
     statements.searchNarrators = db.prepare(`
@@ -199,15 +190,11 @@ function getDb() {
       ORDER BY name
     `);
     statements.getNarratorsByGrade = db.prepare(`
-      SELECT r.*, COUNT(h.id) as hadith_count
+      SELECT r.*, s.hadith_count
       FROM rawis r
-      LEFT JOIN hadith_chains c ON r.scholar_indx = c.scholar_indx
-      LEFT JOIN hadiths h ON c.source = h.source
-          AND c.chapter_no = h.chapter_no
-          AND c.hadith_no = h.hadith_no
+      JOIN narrator_stats s ON r.scholar_indx = s.scholar_indx
       WHERE r.grade = $grade
-      GROUP BY r.scholar_indx
-      ORDER BY hadith_count DESC, r.name
+      ORDER BY s.hadith_count DESC, r.name
     `);
     statements.getNarratorsWithHadithsOnly = db.prepare(`
       SELECT DISTINCT r.*
@@ -219,25 +206,17 @@ function getDb() {
       ORDER BY r.name
     `);
     statements.getNarratorStats = db.prepare(`
-      SELECT r.*, COUNT(h.id) as hadith_count, GROUP_CONCAT(DISTINCT h.source) as sources
+      SELECT r.*, s.hadith_count, s.sources
       FROM rawis r
-      LEFT JOIN hadith_chains c ON r.scholar_indx = c.scholar_indx
-      LEFT JOIN hadiths h ON c.source = h.source
-          AND c.chapter_no = h.chapter_no
-          AND c.hadith_no = h.hadith_no
+      JOIN narrator_stats s ON r.scholar_indx = s.scholar_indx
       WHERE r.scholar_indx = $scholar_indx
-      GROUP BY r.scholar_indx
     `);
     statements.getNarratorsWithHadiths = db.prepare(`
-      SELECT r.*, COUNT(h.id) as hadith_count
-      FROM rawis r
-      JOIN hadith_chains c ON r.scholar_indx = c.scholar_indx
-      JOIN hadiths h ON c.source = h.source
-          AND c.chapter_no = h.chapter_no
-          AND c.hadith_no = h.hadith_no
-      WHERE h.source = $source
-      GROUP BY r.scholar_indx
-      ORDER BY hadith_count DESC, r.name
+      SELECT r.*, s.hadith_count
+      FROM narrator_source_stats s
+      JOIN rawis r ON r.scholar_indx = s.scholar_indx
+      WHERE s.source = $source
+      ORDER BY s.hadith_count DESC, r.name
     `);
 
     statements.getHadithsFromNarratorToNarrator = db.prepare(`
@@ -260,20 +239,25 @@ function getDb() {
     `);
 
     statements.getNarratorPairs = db.prepare(`
-      SELECT DISTINCT r1.name as from_narrator, r2.name as to_narrator, COUNT(*) as hadith_count
-      FROM hadith_chains c1
-      JOIN hadith_chains c2 ON
-        c1.source = c2.source AND
-        c1.chapter_no = c2.chapter_no AND
-        c1.hadith_no = c2.hadith_no AND
-        c2.position = c1.position + 1
-      JOIN rawis r1 ON c1.scholar_indx = r1.scholar_indx
-      JOIN rawis r2 ON c2.scholar_indx = r2.scholar_indx
-      WHERE ($source IS NULL OR c1.source = $source)
+      SELECT r1.name as from_narrator, r2.name as to_narrator, SUM(e.hadith_count) as hadith_count
+      FROM narrator_edges e
+      JOIN rawis r1 ON e.from_indx = r1.scholar_indx
+      JOIN rawis r2 ON e.to_indx = r2.scholar_indx
+      WHERE ($source IS NULL OR e.source = $source)
       GROUP BY r1.name, r2.name
-      HAVING COUNT(*) > 0
       ORDER BY hadith_count DESC
     `);
+
+    statements.searchHadiths = db.prepare(`
+      SELECT h.*,
+        snippet(hadiths_fts, 0, '<mark>', '</mark>', '…', 16) as snippet,
+        bm25(hadiths_fts) as rank
+      FROM hadiths_fts
+      JOIN hadiths h ON h.id = hadiths_fts.rowid
+      WHERE hadiths_fts MATCH $query
+      ORDER BY rank
+      LIMIT $limit
+    `);
   }
   return db;
 }
@@ -301,6 +285,10 @@ export function getHadithById(
   }) as Hadith | null;
 }
 
+export function decodeChain(chain: string | null): number[] {
+  return chain ? (JSON.parse(chain) as number[]) : [];
+}
+
 export function getChainForHadith(
   source: string,
   chapter: string,
@@ -459,6 +447,28 @@ export function getNarratorPairs(source: Source): NarratorPair[] {
   }) as NarratorPair[];
 }
 
+// Quote every normalized term as an FTS5 phrase, so user input is never parsed as query syntax
+function toFtsQuery(query: string): string {
+  return normalizeForSearch(query)
+    .split(" ")
+    .filter(Boolean)
+    .map((term) => `"${term.replace(/"/g, '""')}"`)
+    .join(" ");
+}
+
+export function searchHadiths(
+  query: string,
+  limit: number = 50,
+): HadithSearchResult[] {
+  const ftsQuery = toFtsQuery(query);
+  if (!ftsQuery) return [];
+  getDb();
+  return statements.searchHadiths!.all({
+    $query: ftsQuery,
+    $limit: limit,
+  }) as HadithSearchResult[];
+}
+
 export function close() {
   if (db) {
     // Clean up prepared statements
@@ -0,0 +1,308 @@
+import argparse
+import random
+import sqlite3
+import statistics
+import time
+from pathlib import Path
+
+from scripts.gen_db import decode_chain, normalize_search_text
+from scripts.gen_search_index import normalize_whitespace, strip_diacritics
+
+DB_PATH = Path("data/sqlite.db")
+REPEAT = 5
+
+
+def time_query(
+    conn: sqlite3.Connection, sql: str, params=(), repeat: int = REPEAT
+) -> tuple[float, int]:
+    """Median latency in milliseconds and row count of a query"""
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - start_time) * 1000)
+    return statistics.median(timings), len(rows)
+
+
+def fts_query(term: str) -> str:
+    """Quote a search term as an FTS5 phrase"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def sample_terms(conn: sqlite3.Connection, column: str, table: str, count: int):
+    """Pick words of at least four letters from random rows, reproducibly"""
+    values = [
+        value for (value,) in conn.execute(f"SELECT {column} FROM {table}") if value
+    ]
+    rng = random.Random(0)
+    terms = []
+    while values and len(terms) < count:
+        words = normalize_whitespace(strip_diacritics(rng.choice(values))).split()
+        words = [word for word in words if len(word) >= 4]
+        if words:
+            terms.append(rng.choice(words))
+    return terms
+
+
+def create_normalized_tables(conn: sqlite3.Connection) -> None:
+    """TEMP copies of the searched columns, normalized like the FTS5 tables.
+
+    The LIKE baseline scans these, so it sees the same text as FTS5 and the normalizing
+    itself stays out of the timings. TEMP tables work on a read-only connection.
+    """
+    conn.create_function(
+        "normalize_search_text", 1, normalize_search_text, deterministic=True
+    )
+    conn.executescript(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS hadiths_normalized AS
+        SELECT id, normalize_search_text(text_ar) AS text_ar FROM hadiths;
+        CREATE TEMP TABLE IF NOT EXISTS rawis_normalized AS
+        SELECT
+            scholar_indx,
+            normalize_search_text(name) AS name,
+            normalize_search_text(full_name) AS full_name
+        FROM rawis;
+        """
+    )
+
+
+def bench_search(conn: sqlite3.Connection, count: int) -> None:
+    """Compare the FTS5 tables with LIKE scans of the same normalized text"""
+    create_normalized_tables(conn)
+    cases = [
+        (
+            "hadith text",
+            sample_terms(conn, "text_ar", "hadiths", count),
+            "SELECT id FROM hadiths_normalized WHERE text_ar LIKE ?",
+            """
+            SELECT h.id, snippet(hadiths_fts, 0, '[', ']', '…', 12)
+            FROM hadiths_fts JOIN hadiths h ON h.id = hadiths_fts.rowid
+            WHERE hadiths_fts MATCH ?
+            ORDER BY bm25(hadiths_fts)
+            """,
+        ),
+        (
+            "narrator name",
+            sample_terms(conn, "name", "rawis", count),
+            """
+            SELECT r.*
+            FROM rawis_normalized n JOIN rawis r ON r.scholar_indx = n.scholar_indx
+            WHERE n.name LIKE ? OR n.full_name LIKE ?
+            ORDER BY r.name
+            """,
+            """
+            SELECT r.*
+            FROM rawis_fts JOIN rawis r ON r.scholar_indx = rawis_fts.rowid
+            WHERE rawis_fts MATCH ?
+            ORDER BY bm25(rawis_fts)
+            """,
+        ),
+    ]
+
+    for label, terms, like_sql, fts_sql in cases:
+        like_ms, fts_ms, like_rows, fts_rows = [], [], 0, 0
+        for term in terms:
+            pattern = f"%{term}%"
+            ms, rows = time_query(
+                conn, like_sql, (pattern,) * like_sql.count("?"), REPEAT
+            )
+            like_ms.append(ms)
+            like_rows += rows
+            ms, rows = time_query(conn, fts_sql, (fts_query(term),), REPEAT)
+            fts_ms.append(ms)
+            fts_rows += rows
+
+        print(
+            f"{label}: {len(terms)} terms, "
+            f"LIKE median {statistics.median(like_ms):.2f} ms ({like_rows} rows), "
+            f"FTS5 median {statistics.median(fts_ms):.2f} ms ({fts_rows} rows)"
+        )
+
+
+JOIN_QUERIES = [
+    (
+        "chain for hadith",
+        """
+        SELECT r.*, c.position
+        FROM hadith_chains c
+        JOIN rawis r ON c.scholar_indx = r.scholar_indx
+        JOIN hadiths h ON c.source = h.source
+            AND c.chapter_no = h.chapter_no
+            AND c.hadith_no = h.hadith_no
+        WHERE c.source = ? AND h.chapter = ? AND c.hadith_no = ?
+        ORDER BY c.position
+        """,
+        "SELECT source, chapter, hadith_no FROM hadiths",
+    ),
+    (
+        "hadiths by chapter",
+        """
+        SELECT h.*, GROUP_CONCAT(r.name) AS narrators
+        FROM hadiths h
+        LEFT JOIN hadith_chains c ON h.source = c.source
+            AND h.chapter_no = c.chapter_no
+            AND h.hadith_no = c.hadith_no
+        LEFT JOIN rawis r ON c.scholar_indx = r.scholar_indx
+        WHERE h.source = ? AND h.chapter = ?
+        GROUP BY h.id
+        """,
+        "SELECT DISTINCT source, chapter FROM hadiths",
+    ),
+    (
+        "hadiths by narrator",
+        """
+        SELECT h.*
+        FROM hadith_chains c
+        JOIN hadiths h ON c.source = h.source
+            AND c.chapter_no = h.chapter_no
+            AND c.hadith_no = h.hadith_no
+        WHERE c.scholar_indx = ?
+        """,
+        "SELECT DISTINCT scholar_indx FROM hadith_chains",
+    ),
+    (
+        "narrators in source",
+        """
+        SELECT DISTINCT r.*
+        FROM rawis r
+        JOIN hadith_chains c ON r.scholar_indx = c.scholar_indx
+        WHERE c.source = ?
+        """,
+        "SELECT DISTINCT source FROM hadiths",
+    ),
+]
+
+
+def sample_params(conn: sqlite3.Connection, sql: str, count: int) -> list[tuple]:
+    """Sample parameter rows in a stable order, so different builds get the same ones"""
+    rows = sorted(conn.execute(sql).fetchall(), key=repr)
+    return random.Random(0).sample(rows, min(count, len(rows)))
+
+
+def bench_joins(conn: sqlite3.Connection, count: int) -> dict[str, float]:
+    """Time the chain/hadith joins lib/sqlite.ts runs, over sampled parameters"""
+    results = {}
+    for label, sql, params_sql in JOIN_QUERIES:
+        timings, total_rows = [], 0
+        for params in sample_params(conn, params_sql, count):
+            ms, rows = time_query(conn, sql, params, REPEAT)
+            timings.append(ms)
+            total_rows += rows
+
+        results[label] = statistics.median(timings) if timings else 0.0
+        print(
+            f"{label}: {len(timings)} queries, "
+            f"median {results[label]:.3f} ms ({total_rows} rows)"
+        )
+    return results
+
+
+def packed_chain(conn: sqlite3.Connection, params: tuple) -> list[tuple]:
+    """A chain from hadiths.chain: one hadith read, then one batched rawis lookup"""
+    chains = conn.execute(
+        "SELECT chain FROM hadiths WHERE source = ? AND chapter = ? AND hadith_no = ?",
+        params,
+    ).fetchall()
+    indices = [indx for (chain,) in chains for indx in decode_chain(chain)]
+    narrators = {
+        row[0]: row
+        for row in conn.execute(
+            "SELECT * FROM rawis WHERE scholar_indx IN "
+            f"({', '.join('?' * len(indices))})",
+            indices,
+        )
+    }
+    return [narrators[indx] for indx in indices if indx in narrators]
+
+
+def bench_chains(conn: sqlite3.Connection, count: int) -> dict[str, float]:
+    """Compare the chain join with reads of the packed hadiths.chain column"""
+    join_sql = JOIN_QUERIES[0][1]
+    samples = sample_params(conn, JOIN_QUERIES[0][2], count)
+    join_ms, packed_ms, join_rows, packed_rows = [], [], 0, 0
+    for params in samples:
+        ms, rows = time_query(conn, join_sql, params, REPEAT)
+        join_ms.append(ms)
+        join_rows += rows
+
+        timings = []
+        for _ in range(REPEAT):
+            start_time = time.perf_counter()
+            rows = len(packed_chain(conn, params))
+            timings.append((time.perf_counter() - start_time) * 1000)
+        packed_ms.append(statistics.median(timings))
+        packed_rows += rows
+
+    results = {
+        "chain join": statistics.median(join_ms) if join_ms else 0.0,
+        "packed chain": statistics.median(packed_ms) if packed_ms else 0.0,
+    }
+    print(
+        f"{len(samples)} hadiths, join median {results['chain join']:.3f} ms "
+        f"({join_rows} rows), packed median {results['packed chain']:.3f} ms "
+        f"({packed_rows} rows)"
+    )
+    return results
+
+
+BENCHMARKS = {
+    "search": bench_search,
+    "joins": bench_joins,
+    "chains": bench_chains,
+}
+
+
+def run_benchmarks(db: Path, names: list[str], count: int) -> dict:
+    """Run the named benchmarks against one DB, returning any latencies they report"""
+    conn = sqlite3.connect(f"file:{db}?mode=ro", uri=True)
+    results = {}
+    try:
+        for name in names:
+            print(f"== {name} ({db}) ==")
+            results[name] = BENCHMARKS[name](conn, count)
+    finally:
+        conn.close()
+    return results
+
+
+def print_deltas(db: Path, other: Path, results: dict, other_results: dict) -> None:
+    size, other_size = db.stat().st_size, other.stat().st_size
+    print(f"\n== {db} -> {other} ==")
+    print(
+        f"DB size: {size / 2**20:,.2f} MiB -> {other_size / 2**20:,.2f} MiB "
+        f"({(other_size - size) / max(size, 1):+.1%})"
+    )
+    for name, latencies in results.items():
+        for label, ms in (latencies or {}).items():
+            other_ms = other_results[name][label]
+            print(
+                f"{label}: {ms:.3f} ms -> {other_ms:.3f} ms "
+                f"(x{other_ms / max(ms, 1e-9):.2f})"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark queries against the DB")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument(
+        "--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS)
+    )
+    parser.add_argument(
+        "--count", type=int, default=50, help="Number of sampled queries per case"
+    )
+    parser.add_argument(
+        "--compare",
+        type=Path,
+        help="Second DB, e.g. a --schema compact build, to report size and latency deltas against",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.db, args.benchmarks, args.count)
+    if args.compare:
+        other_results = run_benchmarks(args.compare, args.benchmarks, args.count)
+        print_deltas(args.db, args.compare, results, other_results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+from functools import partial
+
+from scripts.map_data import (
+    ALIGN_WINDOW,
+    BLOCK_MB,
+    MATCH_ENGINES,
+    SHORTLIST_SIZE,
+    match_hadiths,
+    read_hadiths_by_source,
+    strip_diacritics,
+)
+from scripts.profiling import peak_rss_mb
+
+HONORIFICS = ["صلى الله عليه وسلم", "رضي الله عنه", "رضي الله عنها", "رحمه الله"]
+DEFAULT_SCALES = [250, 1000, 4000]
+
+
+def remove_diacritics(text, rng):
+    return strip_diacritics(text)
+
+
+def truncate(text, rng):
+    words = text.split()
+    keep = max(1, int(len(words) * rng.uniform(0.7, 0.95)))
+    return " ".join(words[:keep])
+
+
+def insert_honorifics(text, rng):
+    words = text.split()
+    for _ in range(rng.randint(1, 3)):
+        words.insert(rng.randint(0, len(words)), rng.choice(HONORIFICS))
+    return " ".join(words)
+
+
+PERTURBATIONS = [remove_diacritics, truncate, insert_honorifics]
+
+
+def make_corpus(rows, scale, rng, open_ratio=0.8, noise_ratio=0.1):
+    """Build a synthetic corpus and open hadiths with a known ground truth.
+
+    Corpus rows cycle through the real rows in book order; rows past the first cycle get
+    honorifics inserted, so they are near-duplicates rather than exact copies. Open
+    hadiths are perturbed copies of a sample of corpus rows, kept in book order, plus
+    noise rows made of shuffled words that have no true match.
+    """
+    hadiths = []
+    for i in range(scale):
+        text = rows[i % len(rows)]["text_ar"]
+        if i >= len(rows):
+            text = insert_honorifics(text, rng)
+        hadiths.append({"id": str(i), "hadith_no": str(i), "text_ar": text})
+
+    open_hadiths = []
+    truth = {}
+    for i in sorted(rng.sample(range(scale), int(scale * open_ratio))):
+        text = hadiths[i]["text_ar"]
+        for perturb in rng.sample(PERTURBATIONS, rng.randint(1, len(PERTURBATIONS))):
+            text = perturb(text, rng)
+        open_hadiths.append([str(len(open_hadiths)), text])
+        truth[open_hadiths[-1][0]] = hadiths[i]["id"]
+
+    for _ in range(int(scale * noise_ratio)):
+        words = rng.choice(hadiths)["text_ar"].split()
+        rng.shuffle(words)
+        oh_id = f"noise-{len(truth)}"
+        open_hadiths.insert(rng.randint(0, len(open_hadiths)), [oh_id, " ".join(words)])
+        truth[oh_id] = None
+
+    return hadiths, open_hadiths, truth
+
+
+def make_scorer(engine, top_k, block_mb, window):
+    if engine == "ngram":
+        return partial(MATCH_ENGINES[engine], top_k=top_k)
+    if engine == "batched":
+        return partial(MATCH_ENGINES[engine], block_mb=block_mb)
+    if engine == "aligned":
+        return partial(MATCH_ENGINES[engine], window=window)
+    return MATCH_ENGINES[engine]
+
+
+def run_engine(engine, scorer, hadiths, open_hadiths, truth):
+    """Match one synthetic corpus with one engine; runs in a fresh process per call"""
+    explanations = {oh[0]: "-" for oh in open_hadiths}
+    rss_before = peak_rss_mb()
+
+    start_time = time.perf_counter()
+    matched, _ = match_hadiths(open_hadiths, hadiths, explanations, scorer=scorer)
+    wall = time.perf_counter() - start_time
+
+    rss_after = peak_rss_mb()
+    correct = sum(truth[oh_id] == hadith_id for oh_id, hadith_id, _ in matched)
+    expected = sum(hadith_id is not None for hadith_id in truth.values())
+
+    return {
+        "engine": engine,
+        "corpus": len(hadiths),
+        "open": len(open_hadiths),
+        "wall_s": round(wall, 4),
+        # Throughput in terms of the exhaustive workload, so engines are comparable
+        "pairs_per_s": round(len(hadiths) * len(open_hadiths) / max(wall, 1e-9)),
+        "peak_rss_mb": round(rss_after - rss_before, 1),
+        "precision": round(correct / max(len(matched), 1), 4),
+        "recall": round(correct / max(expected, 1), 4),
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as file:
+        baseline = {(r["corpus"], r["engine"]): r for r in json.load(file)["results"]}
+
+    print(f"\nCompared with {baseline_path}:")
+    for r in results:
+        base = baseline.get((r["corpus"], r["engine"]))
+        if base is None:
+            continue
+        print(
+            f"{r['engine']:>10} @ {r['corpus']:>6}: "
+            f"wall x{r['wall_s'] / max(base['wall_s'], 1e-9):.2f}, "
+            f"precision {r['precision'] - base['precision']:+.4f}, "
+            f"recall {r['recall'] - base['recall']:+.4f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark speed and accuracy of the map_data matching engines"
+    )
+    parser.add_argument("--source", default="Sahih Bukhari")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument(
+        "--engines", nargs="+", choices=list(MATCH_ENGINES), default=list(MATCH_ENGINES)
+    )
+    parser.add_argument("--top-k", type=int, default=SHORTLIST_SIZE)
+    parser.add_argument("--block-mb", type=int, default=BLOCK_MB)
+    parser.add_argument("--window", type=int, default=ALIGN_WINDOW)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        default="map_data_bench.json",
+        help="Where to write the machine-readable results",
+    )
+    parser.add_argument(
+        "--baseline", help="Results file of an earlier run to compare against"
+    )
+    args = parser.parse_args()
+
+    rows = read_hadiths_by_source(
+        os.path.join("data", "hadiths_dataset.csv"), [args.source]
+    )[args.source].to_dicts()
+
+    results = []
+    for scale in args.scales:
+        hadiths, open_hadiths, truth = make_corpus(
+            rows, scale, random.Random(args.seed)
+        )
+        for engine in args.engines:
+            scorer = make_scorer(engine, args.top_k, args.block_mb, args.window)
+            # A fresh process per run keeps peak RSS figures independent
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(
+                    run_engine, engine, scorer, hadiths, open_hadiths, truth
+                ).result()
+            results.append(result)
+            print(
+                f"{engine:>10} @ {scale:>6}: {result['wall_s']:.2f}s, "
+                f"{result['pairs_per_s']:,} pairs/s, {result['peak_rss_mb']} MB, "
+                f"precision {result['precision']:.3f}, recall {result['recall']:.3f}"
+            )
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "created": datetime.now(timezone.utc).isoformat(),
+                "source": args.source,
+                "seed": args.seed,
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+    print(f"Wrote results to {args.output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
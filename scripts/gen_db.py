@@ -1,12 +1,42 @@
+import argparse
+import hashlib
 import json
+import os
 import polars as pl
+import shutil
 import sqlite3
+import time
 from pathlib import Path
 
+from scripts.gen_search_index import normalize_whitespace, strip_diacritics
+from scripts.hadith_collections import SOURCE_FOLDERS
+from scripts.profiling import peak_rss_mb
 
-def create_tables(conn: sqlite3.Connection) -> None:
-    conn.executescript(
-        """
+BUILD_PRAGMAS = {
+    "journal_mode": "OFF",
+    "synchronous": "OFF",
+    "cache_size": -262144,  # 256 MiB
+    "temp_store": "MEMORY",
+}
+INSERT_BATCH_SIZE = 50_000
+
+DB_PATH = Path("data/sqlite.db")
+MANIFEST_PATH = Path("data/sqlite.manifest.json")
+# Page size of published DBs; larger pages keep long hadith texts off overflow pages
+PUBLISH_PAGE_SIZE = 8192
+# Fixed bench_db query set timed before and after publishing
+PUBLISH_BENCHMARKS = ["joins", "chains"]
+PUBLISH_SAMPLE_SIZE = 50
+# A change to any of these, or to --schema/--publish, invalidates every stage
+CODE_FILES = [
+    Path("scripts/gen_db.py"),
+    Path("scripts/hadith_collections.py"),
+    Path("scripts/gen_search_index.py"),
+]
+
+
+HADITH_TABLES = {
+    "legacy": """
     CREATE TABLE hadiths (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         hadith_id INTEGER,
@@ -17,9 +47,70 @@ def create_tables(conn: sqlite3.Connection) -> None:
         text_ar TEXT,
         text_en TEXT,
         explanation TEXT,
+        chain TEXT, -- JSON array of scholar_indx in chain order
         UNIQUE(source, chapter_no, hadith_no)
     );
 
+    CREATE TABLE hadith_chains (
+        source TEXT,
+        chapter_no INTEGER,
+        hadith_no TEXT,
+        scholar_indx INTEGER,
+        position INTEGER,
+        FOREIGN KEY(source, chapter_no, hadith_no) REFERENCES hadiths(source, chapter_no, hadith_no),
+        FOREIGN KEY(scholar_indx) REFERENCES rawis(scholar_indx),
+        PRIMARY KEY(source, chapter_no, hadith_no, scholar_indx)
+    );
+    """,
+    # Chains point at hadiths by integer id and source names are stored once; the
+    # views keep the legacy column shape for lib/sqlite.ts
+    "compact": """
+    CREATE TABLE collections (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE
+    );
+
+    CREATE TABLE hadith_rows (
+        id INTEGER PRIMARY KEY,
+        hadith_id INTEGER,
+        source_id INTEGER,
+        chapter_no INTEGER,
+        hadith_no TEXT,
+        chapter TEXT,
+        text_ar TEXT,
+        text_en TEXT,
+        explanation TEXT,
+        chain TEXT, -- JSON array of scholar_indx in chain order
+        FOREIGN KEY(source_id) REFERENCES collections(id),
+        UNIQUE(source_id, chapter_no, hadith_no)
+    );
+
+    CREATE TABLE chain_links (
+        hadith_id INTEGER,
+        position INTEGER,
+        scholar_indx INTEGER,
+        FOREIGN KEY(hadith_id) REFERENCES hadith_rows(id),
+        FOREIGN KEY(scholar_indx) REFERENCES rawis(scholar_indx),
+        PRIMARY KEY(hadith_id, position)
+    ) WITHOUT ROWID;
+
+    CREATE VIEW hadiths AS
+    SELECT h.id, h.hadith_id, s.name AS source, h.chapter_no, h.hadith_no, h.chapter,
+        h.text_ar, h.text_en, h.explanation, h.chain
+    FROM hadith_rows h
+    JOIN collections s ON h.source_id = s.id;
+
+    CREATE VIEW hadith_chains AS
+    SELECT s.name AS source, h.chapter_no, h.hadith_no, l.scholar_indx, l.position
+    FROM chain_links l
+    JOIN hadith_rows h ON l.hadith_id = h.id
+    JOIN collections s ON h.source_id = s.id;
+    """,
+}
+
+
+STAGE_TABLES = {
+    "rawis": """
     CREATE TABLE rawis (
         scholar_indx INTEGER PRIMARY KEY,
         name TEXT,
@@ -32,18 +123,19 @@ def create_tables(conn: sqlite3.Connection) -> None:
         death_date_gregorian INTEGER,
         death_place TEXT
     );
-
-    CREATE TABLE hadith_chains (
+    """,
+    # Prepended with HADITH_TABLES[schema]
+    "hadiths": """
+    -- Teacher -> student adjacency precomputed from hadith_chains
+    CREATE TABLE narrator_edges (
+        from_indx INTEGER,
+        to_indx INTEGER,
         source TEXT,
-        chapter_no INTEGER,
-        hadith_no TEXT,
-        scholar_indx INTEGER,
-        position INTEGER,
-        FOREIGN KEY(source, chapter_no, hadith_no) REFERENCES hadiths(source, chapter_no, hadith_no),
-        FOREIGN KEY(scholar_indx) REFERENCES rawis(scholar_indx),
-        PRIMARY KEY(source, chapter_no, hadith_no, scholar_indx)
-    );
-
+        hadith_count INTEGER,
+        PRIMARY KEY(from_indx, source, to_indx)
+    ) WITHOUT ROWID;
+    """,
+    "sources": """
     CREATE TABLE sources (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         scholar_indx INTEGER,
@@ -51,27 +143,162 @@ def create_tables(conn: sqlite3.Connection) -> None:
         content TEXT,
         FOREIGN KEY(scholar_indx) REFERENCES rawis(scholar_indx)
     );
+    """,
+}
+
+
+def create_tables(
+    conn: sqlite3.Connection, schema: str = "legacy", stages: list[str] | None = None
+) -> None:
+    for stage in stages or list(STAGE_TABLES):
+        if stage == "hadiths":
+            conn.executescript(HADITH_TABLES[schema])
+        conn.executescript(STAGE_TABLES[stage])
+
+
+# Secondary indexes, built once the data is loaded. Each one serves queries in
+# lib/sqlite.ts; lookups by (source, chapter_no, hadith_no) are already served by the
+# UNIQUE/PRIMARY KEY indexes of hadiths and hadith_chains.
+POST_LOAD_INDEXES = [
+    # getNarratorByName, getHadithsFromNarratorToNarrator, ORDER BY name
+    "CREATE INDEX idx_rawis_name ON rawis(name)",
+    # getNarratorsByGrade
+    "CREATE INDEX idx_rawis_grade ON rawis(grade)",
+    # getNarratorSources
+    "CREATE INDEX idx_sources_scholar ON sources(scholar_indx)",
+    # getPredecessors; the primary key already covers lookups by from_indx
+    "CREATE INDEX idx_edges_to ON narrator_edges(to_indx, source, from_indx, hadith_count)",
+]
 
-    -- Indexes for hadiths table (read-heavy optimization)
-    CREATE INDEX idx_hadiths_hadith_id ON hadiths(hadith_id);
-    CREATE INDEX idx_hadiths_source_chapter ON hadiths(source, chapter_no);  -- For chapter browsing
-    CREATE INDEX idx_hadiths_text_ar ON hadiths(text_ar);  -- For Arabic text search
-    CREATE INDEX idx_hadiths_text_en ON hadiths(text_en);  -- For English text search
-
-    -- Indexes for rawis table (read-heavy optimization)
-    CREATE INDEX idx_rawis_name ON rawis(name);
-    CREATE INDEX idx_rawis_full_name ON rawis(full_name);
-    CREATE INDEX idx_rawis_grade ON rawis(grade);  -- For filtering by scholar grade
-    CREATE INDEX idx_rawis_death_date ON rawis(death_date_hijri, death_date_gregorian);  -- For timeline queries
-
-    -- Indexes for hadith_chains table (read-heavy optimization)
-    CREATE INDEX idx_chains_scholar_pos ON hadith_chains(scholar_indx, position);  -- Combined index for chain analysis
-    CREATE INDEX idx_chains_source_scholar ON hadith_chains(source, scholar_indx);  -- For finding scholar's hadiths
-    CREATE INDEX idx_chains_scholar_chapter ON hadith_chains(scholar_indx, chapter_no);  -- For chapter counting queries
-
-    -- Index for sources table
-    CREATE INDEX idx_sources_scholar ON sources(scholar_indx);
+SCHEMA_INDEXES = {
+    "legacy": [
+        # getHadithById, getHadithsByChapter
+        "CREATE INDEX idx_hadiths_source_chapter_name ON hadiths(source, chapter, hadith_no)",
+        # getSuccessors, getPredecessors, getNarratorChapters, narrator hadith counts
+        "CREATE INDEX idx_chains_scholar ON hadith_chains(scholar_indx, source, chapter_no, hadith_no, position)",
+        # getNarratorsInSource
+        "CREATE INDEX idx_chains_source_scholar ON hadith_chains(source, scholar_indx)",
+    ],
+    "compact": [
+        # getHadithById, getHadithsByChapter
+        "CREATE INDEX idx_hadith_rows_source_chapter_name ON hadith_rows(source_id, chapter, hadith_no)",
+        # getNarratorsInSource, getHadithsFromNarratorToNarrator, narrator hadith counts
+        "CREATE INDEX idx_links_scholar ON chain_links(scholar_indx, hadith_id, position)",
+    ],
+}
+
+
+SEARCH_TABLES = [
+    """
+    CREATE VIRTUAL TABLE hadiths_fts USING fts5(
+        text_ar, text_en, chapter, tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    """
+    CREATE VIRTUAL TABLE rawis_fts USING fts5(
+        name, full_name, tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    """
+    INSERT INTO hadiths_fts (rowid, text_ar, text_en, chapter)
+    SELECT
+        id,
+        normalize_search_text(text_ar),
+        normalize_search_text(text_en),
+        normalize_search_text(chapter)
+    FROM hadiths""",
+    """
+    INSERT INTO rawis_fts (rowid, name, full_name)
+    SELECT scholar_indx, normalize_search_text(name), normalize_search_text(full_name)
+    FROM rawis""",
+    "INSERT INTO hadiths_fts (hadiths_fts) VALUES ('optimize')",
+    "INSERT INTO rawis_fts (rawis_fts) VALUES ('optimize')",
+]
+
+
+def normalize_search_text(text: str | None) -> str | None:
+    """The normalization gen_search_index applies, so both search paths agree"""
+    return normalize_whitespace(strip_diacritics(text))
+
+
+def create_search_tables(conn: sqlite3.Connection) -> None:
+    """Build FTS5 indexes over normalized hadith text and narrator names.
+
+    The rowids are hadiths.id and rawis.scholar_indx, so matches join straight back to
+    the base tables. Ranking uses bm25() and highlighting snippet().
     """
+    start_time = time.perf_counter()
+    conn.create_function(
+        "normalize_search_text", 1, normalize_search_text, deterministic=True
+    )
+    # Not executescript, which would commit the load transaction early
+    for sql in SEARCH_TABLES:
+        conn.execute(sql)
+    print(f"Built full-text indexes in {time.perf_counter() - start_time:.2f}s")
+
+
+def index_size(conn: sqlite3.Connection, name: str) -> int | None:
+    """Size of an index in bytes, if SQLite was built with the dbstat table"""
+    try:
+        return conn.execute(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)
+        ).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+def create_indexes(conn: sqlite3.Connection, schema: str = "legacy") -> None:
+    for sql in SCHEMA_INDEXES[schema] + POST_LOAD_INDEXES:
+        name = sql.split()[2]
+        start_time = time.perf_counter()
+        conn.execute(sql)
+        elapsed = time.perf_counter() - start_time
+
+        size = index_size(conn, name)
+        size = "unknown size" if size is None else f"{size / 1024:,.0f} KiB"
+        print(f"Built {name} in {elapsed:.2f}s ({size})")
+
+
+def apply_build_pragmas(conn: sqlite3.Connection) -> None:
+    """Trade durability for load speed; a failed build is simply rerun from scratch"""
+    for pragma, value in BUILD_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+
+def bulk_insert(conn: sqlite3.Connection, table: str, df: pl.DataFrame) -> None:
+    """Stream a DataFrame into an existing table as Arrow record batches.
+
+    Rows go through executemany in the connection's open transaction, which main
+    commits once after every table is loaded.
+    """
+    start_time = time.perf_counter()
+    sql = (
+        f"INSERT INTO {table} ({', '.join(df.columns)}) "
+        f"VALUES ({', '.join('?' * df.width)})"
+    )
+
+    for batch in df.to_arrow().to_batches(max_chunksize=INSERT_BATCH_SIZE):
+        conn.executemany(sql, zip(*(column.to_pylist() for column in batch.columns)))
+
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"Inserted {df.height} rows into {table} in {elapsed:.2f}s "
+        f"({df.height / max(elapsed, 1e-9):,.0f} rows/s)"
+    )
+
+
+def collect_stage(stage: str, lf: pl.LazyFrame, explain: bool = False) -> pl.DataFrame:
+    """Collect one stage of the build with the streaming engine"""
+    if explain:
+        print(f"Optimized plan for {stage}:\n{lf.explain(streaming=True)}")
+    return lf.collect(streaming=True)
+
+
+def collection_names(hadiths: pl.LazyFrame) -> list[str | None]:
+    """Distinct source names, which partition the build into per-collection batches"""
+    return (
+        hadiths.select(pl.col("source").str.strip_chars().unique().sort())
+        .collect(streaming=True)
+        .to_series()
+        .to_list()
     )
 
 
@@ -96,13 +323,7 @@ def insert_sources(conn: sqlite3.Connection) -> None:
         )
     )
 
-    # Convert to list of tuples for executemany
-    values = list(sources_df.iter_rows())
-
-    conn.executemany(
-        "INSERT INTO sources (scholar_indx, book_source, content) VALUES (?, ?, ?)",
-        values,
-    )
+    bulk_insert(conn, "sources", sources_df.rename({"scholar_id": "scholar_indx"}))
 
 
 def clean_arabic_text(original: str) -> str:
@@ -128,149 +349,249 @@ def clean_arabic_text(original: str) -> str:
     return clean
 
 
-def load_explanations(source: str) -> pl.DataFrame:
+# Characters clean_arabic_text deletes, and the whitespace str.strip() removes: every
+# code point whose str.isspace() is true, i.e.
+# "".join(chr(c) for c in range(0x110000) if chr(c).isspace())
+CLEAN_TEXT_PATTERN = r"[a-zA-Z\-'()\[\],.‘;`/#0-9]"
+PYTHON_WHITESPACE = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004"
+    "\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000"
+)
+
+
+def clean_arabic_text_expr(column: str) -> pl.Expr:
+    """Vectorized equivalent of clean_arabic_text for a string column"""
+    original = pl.col(column)
+    clean = (
+        original.str.replace_all(CLEAN_TEXT_PATTERN, "")
+        # It has to be done in this order, because the second replace is a subset of the first.
+        .str.replace_all("رضي الله عنها", "", literal=True)
+        .str.replace_all("رضي الله عنه", "", literal=True)
+        .str.strip_chars(PYTHON_WHITESPACE)
+    )
+
+    # Should get rid of this after fixing https://github.com/ElGarash/isnad/issues/18
+    return pl.when(clean == "").then(original).otherwise(clean).alias(column)
+
+
+def verify_clean_arabic_text(hadiths: pl.LazyFrame, rawis: pl.LazyFrame) -> None:
+    """Check that clean_arabic_text_expr matches clean_arabic_text on every chapter and name"""
+    for lf, column in [(hadiths, "chapter"), (rawis, "name")]:
+        values = lf.select(pl.col(column).cast(pl.Utf8)).collect(streaming=True)
+        expected = values.select(
+            pl.col(column).map_elements(clean_arabic_text, return_dtype=pl.Utf8)
+        ).to_series()
+        actual = values.select(clean_arabic_text_expr(column)).to_series()
+
+        mismatches = values.filter(~expected.eq_missing(actual)).height
+        if mismatches:
+            raise ValueError(
+                f"clean_arabic_text_expr differs on {mismatches} {column} values"
+            )
+        print(f"clean_arabic_text_expr matches on all {values.height} {column} values")
+
+
+def load_explanations(folder: str, source: str) -> pl.LazyFrame:
     """Load hadith explanations and join with mapped hadiths to create mapping of hadith_no -> explanation"""
-    explanations_df = pl.read_csv(
-        f"data/{source}/explanations.csv",
+    explanations_df = pl.scan_csv(
+        f"data/{folder}/explanations.csv",
         has_header=False,
         new_columns=["hadith_id", "hadith_text", "explanation"],
     )
 
     # Create mapping from matched_hadiths.csv and normalize hadith_no
-    matches_df = pl.read_csv(f"data/{source}/matched_hadiths.csv").with_columns(
+    matches_df = pl.scan_csv(f"data/{folder}/matched_hadiths.csv").with_columns(
         pl.col("hadith_no").str.strip_chars().str.replace(r"\s+", " ")
     )
 
     # Join the dataframes to get hadith_no -> explanation mapping
-    return matches_df.join(
-        explanations_df, left_on="open_hadith_id", right_on="hadith_id", how="left"
-    ).select(["id", "hadith_no", "explanation", "hadith_text"])
+    return (
+        matches_df.join(
+            explanations_df, left_on="open_hadith_id", right_on="hadith_id", how="left"
+        )
+        .select(["id", "hadith_no", "explanation", "hadith_text"])
+        .with_columns(pl.lit(source).alias("source"))
+    )
 
 
-# TODO: Add Diacritics for hadiths with no explanations as well
-def insert_hadiths(conn: sqlite3.Connection, hadiths_df: pl.DataFrame) -> None:
-    """Insert hadiths into SQLite database with explanations and diacritical text for Bukhari and Muslim hadiths"""
-    processed_hadiths = hadiths_df.select(
-        [
-            "hadith_id",
-            pl.col("source").str.strip_chars(),
-            "chapter_no",
-            pl.col("hadith_no").str.strip_chars(),
-            pl.col("chapter").map_elements(clean_arabic_text, return_dtype=pl.Utf8),
-            "text_ar",  # We'll replace this with diacritical text where available
-            "text_en",
-            "id",
-        ]
-    )
+def load_all_explanations(explain: bool = False) -> pl.DataFrame:
+    """Explanations of every collection in SOURCE_FOLDERS, read in parallel.
 
-    bukhari_hadiths = processed_hadiths.filter(pl.col("source") == "Sahih Bukhari")
-    muslim_hadiths = processed_hadiths.filter(pl.col("source") == "Sahih Muslim")
-    other_hadiths = processed_hadiths.filter(
-        (pl.col("source") != "Sahih Bukhari") & (pl.col("source") != "Sahih Muslim")
+    Rows are unique on the (source, id, hadith_no) join keys, so merging them can't
+    duplicate hadiths.
+    """
+    return collect_stage(
+        "explanations",
+        pl.concat(
+            [
+                load_explanations(folder, source)
+                for folder, source in SOURCE_FOLDERS.items()
+            ],
+            parallel=True,
+        ).unique(["source", "id", "hadith_no"], keep="first", maintain_order=True),
+        explain,
     )
 
-    bukhari_explanations = load_explanations("bukhari")
-    muslim_explanations = load_explanations("muslim")
 
-    # Join and update text_ar with hadith_text where available
-    bukhari_hadiths = (
-        bukhari_hadiths.with_columns(
-            pl.col("hadith_no").str.strip_chars().alias("normalized_id")
-        )
-        .join(
-            bukhari_explanations.with_columns(pl.col("hadith_no")),
-            left_on=["id", "normalized_id"],
-            right_on=["id", "hadith_no"],
-            how="left",
-        )
-        .with_columns(
+def insert_compact_hadiths(
+    conn: sqlite3.Connection, hadiths: pl.DataFrame
+) -> pl.DataFrame:
+    """Load hadiths into collections and hadith_rows, assigning ids up front.
+
+    Ids follow insertion order, as AUTOINCREMENT assigns them in the legacy schema,
+    and continue from earlier batches. Returns the (id, source, chapter_no, hadith_no)
+    keys chains are linked through.
+    """
+    last_hadith, last_collection = conn.execute(
+        "SELECT (SELECT MAX(id) FROM hadith_rows), (SELECT MAX(id) FROM collections)"
+    ).fetchone()
+    hadiths = hadiths.with_row_index("id", offset=(last_hadith or 0) + 1)
+    collections = hadiths.select(
+        pl.col("source").unique(maintain_order=True).alias("name")
+    ).with_row_index("id", offset=(last_collection or 0) + 1)
+    bulk_insert(conn, "collections", collections)
+
+    rows = hadiths.join(
+        collections.rename({"id": "source_id", "name": "source"}),
+        on="source",
+        how="left",
+        join_nulls=True,
+    ).drop("source")
+    bulk_insert(conn, "hadith_rows", rows)
+
+    return hadiths.select(["id", "source", "chapter_no", "hadith_no"])
+
+
+# TODO: Add Diacritics for hadiths with no explanations as well
+def insert_hadiths(
+    conn: sqlite3.Connection,
+    hadiths_df: pl.LazyFrame,
+    explanations: pl.DataFrame,
+    chains: pl.DataFrame,
+    schema: str = "legacy",
+    explain: bool = False,
+) -> pl.DataFrame | None:
+    """Insert hadiths into SQLite database with explanations and diacritical text for the collections in SOURCE_FOLDERS"""
+    explained_sources = list(SOURCE_FOLDERS.values())
+    hadiths = (
+        hadiths_df.select(
             [
-                pl.when(pl.col("hadith_text").is_not_null())
-                .then(pl.col("hadith_text"))
-                .otherwise(pl.col("text_ar"))
-                .alias("text_ar")
+                "hadith_id",
+                pl.col("source").str.strip_chars(),
+                "chapter_no",
+                pl.col("hadith_no").str.strip_chars(),
+                clean_arabic_text_expr("chapter"),
+                "text_ar",  # We'll replace this with diacritical text where available
+                "text_en",
+                "id",
             ]
         )
-        .drop(["normalized_id", "hadith_text"])
-        .unique(["hadith_id"])
-    )
-
-    muslim_hadiths = (
-        muslim_hadiths.with_columns(
-            pl.col("hadith_no").str.strip_chars().alias("normalized_id")
-        )
+        .filter(pl.col("source").is_not_null())
+        # Join and update text_ar with hadith_text where available
+        .join(explanations.lazy(), on=["source", "id", "hadith_no"], how="left")
+        .with_columns(pl.coalesce("hadith_text", "text_ar").alias("text_ar"))
         .join(
-            muslim_explanations.with_columns(pl.col("hadith_no")),
-            left_on=["id", "normalized_id"],
-            right_on=["id", "hadith_no"],
+            pack_chains(chains).lazy(),
+            on=["source", "chapter_no", "hadith_no"],
             how="left",
+            join_nulls=True,
         )
-        .with_columns(
+        # A fixed row order keeps ids, and so the stage's output hash, reproducible
+        .sort(["chapter_no", "hadith_id", "hadith_no"], nulls_last=True)
+        # Explained collections keep one row per hadith_id
+        .filter(
+            ~pl.col("source").is_in(explained_sources)
+            | pl.col("hadith_id").is_first_distinct().over("source")
+        )
+        .select(
             [
-                pl.when(pl.col("hadith_text").is_not_null())
-                .then(pl.col("hadith_text"))
-                .otherwise(pl.col("text_ar"))
-                .alias("text_ar")
+                "hadith_id",
+                "source",
+                "chapter_no",
+                "hadith_no",
+                "chapter",
+                "text_ar",
+                "text_en",
+                "explanation",
+                "chain",
             ]
         )
-        .drop(["normalized_id", "hadith_text"])
-        .unique(["hadith_id"])
     )
+    hadiths = collect_stage("hadiths", hadiths, explain)
 
-    print(
-        f"Matched {bukhari_hadiths.filter(pl.col('explanation').is_not_null()).height} Bukhari explanations"
-    )
-    print(
-        f"Matched {muslim_hadiths.filter(pl.col('explanation').is_not_null()).height} Muslim explanations"
-    )
+    for source in explained_sources:
+        explained = hadiths.filter(pl.col("source") == source)
+        if explained.height:
+            print(
+                f"Matched {explained.filter(pl.col('explanation').is_not_null()).height} {source} explanations"
+            )
 
-    other_hadiths = other_hadiths.with_columns(pl.lit(None).alias("explanation"))
+    if schema == "compact":
+        return insert_compact_hadiths(conn, hadiths)
+    bulk_insert(conn, "hadiths", hadiths)
 
-    pl.concat([bukhari_hadiths, muslim_hadiths, other_hadiths], how="vertical").select(
-        [
-            "hadith_id",
-            "source",
-            "chapter_no",
-            "hadith_no",
-            "chapter",
-            "text_ar",
-            "text_en",
-            "explanation",
-        ]
-    ).to_pandas().to_sql("hadiths", conn, if_exists="append", index=False)
 
+def load_place_translations() -> pl.DataFrame:
+    """Load place translations as a (place, translation) lookup table"""
+    with open(Path("data/place_translations.json")) as f:
+        place_translations = json.load(f)
 
-def translate_place(place: str, translations: dict) -> str | None:
-    """Translate place name using the translations dictionary or return None if not found"""
-    if place is None:
-        return None
+    return pl.DataFrame(
+        {
+            "place": list(place_translations.keys()),
+            "translation": list(place_translations.values()),
+        },
+        schema={"place": pl.Utf8, "translation": pl.Utf8},
+    )
 
-    # Strip any whitespace and normalize
-    normalized_place = place.strip()
 
-    # Return the translation if found, otherwise None
-    return translations.get(normalized_place)
+def translate_places(
+    rawis_df: pl.LazyFrame, translations: pl.DataFrame
+) -> pl.LazyFrame:
+    """Replace death_place with its translation, or None if it has none"""
+    return (
+        rawis_df.with_columns(
+            pl.col("death_place").str.strip_chars(PYTHON_WHITESPACE).alias("place")
+        )
+        .join(translations.lazy(), on="place", how="left")
+        .with_columns(pl.col("translation").alias("death_place"))
+        .drop(["place", "translation"])
+    )
 
 
-def insert_rawis(conn: sqlite3.Connection, rawis_df: pl.DataFrame) -> None:
-    # Load place translations
-    with open(Path("data/place_translations.json")) as f:
-        place_translations = json.load(f)
+def report_untranslated_places(
+    rawis_df: pl.LazyFrame, translations: pl.DataFrame, report_path: Path
+) -> None:
+    """Write the places that have no translation yet, most frequent first"""
+    untranslated = (
+        rawis_df.select(
+            pl.col("death_place").str.strip_chars(PYTHON_WHITESPACE).alias("place")
+        )
+        .filter(pl.col("place").is_not_null() & (pl.col("place") != ""))
+        .join(translations.lazy(), on="place", how="anti")
+        .group_by("place")
+        .agg(pl.len().alias("count"))
+        .sort(["count", "place"], descending=[True, False])
+        .collect(streaming=True)
+    )
 
-    def translate_place_fn(place: str) -> str | None:
-        return translate_place(place, place_translations)
+    untranslated.write_csv(report_path)
+    print(f"{untranslated.height} untranslated death places written to {report_path}")
 
-    rawis_df = rawis_df.with_columns(
-        pl.col("death_place").map_elements(
-            translate_place_fn,
-            return_dtype=pl.Utf8,
-        )
+
+def insert_rawis(
+    conn: sqlite3.Connection, rawis_df: pl.LazyFrame, explain: bool = False
+) -> None:
+    translations = load_place_translations()
+    report_untranslated_places(
+        rawis_df, translations, Path("data/untranslated_places.csv")
     )
+    rawis_df = translate_places(rawis_df, translations)
 
-    rawis_df.select(
+    rawis = rawis_df.select(
         [
             "scholar_indx",
-            pl.col("name").map_elements(clean_arabic_text, return_dtype=pl.Utf8),
+            clean_arabic_text_expr("name"),
             "full_name",
             "grade",
             "parents",
@@ -280,10 +601,12 @@ def insert_rawis(conn: sqlite3.Connection, rawis_df: pl.DataFrame) -> None:
             pl.col("death_date_gregorian").round(0).cast(pl.Int16, wrap_numerical=True),
             "death_place",
         ]
-    ).to_pandas().to_sql("rawis", conn, if_exists="append", index=False)
+    )
 
+    bulk_insert(conn, "rawis", collect_stage("rawis", rawis, explain))
 
-def insert_chains(conn: sqlite3.Connection, hadiths_df: pl.DataFrame) -> None:
+
+def build_chains(hadiths_df: pl.LazyFrame, explain: bool = False) -> pl.DataFrame:
     chains = (
         hadiths_df.with_columns(
             [
@@ -320,12 +643,452 @@ def insert_chains(conn: sqlite3.Connection, hadiths_df: pl.DataFrame) -> None:
                 "position",
             ]
         )
-    ).to_pandas()
+    )
+
+    return collect_stage("hadith_chains", chains, explain)
+
+
+def pack_chains(chains: pl.DataFrame) -> pl.DataFrame:
+    """Each hadith's narrators in chain order, as the JSON array stored in hadiths.chain"""
+    return (
+        chains.filter(pl.col("scholar_indx").is_not_null())
+        .group_by(["source", "chapter_no", "hadith_no"])
+        .agg(
+            pl.format(
+                "[{}]",
+                pl.col("scholar_indx").sort_by("position").cast(pl.Utf8).str.join(","),
+            ).alias("chain")
+        )
+    )
+
+
+def decode_chain(chain: str | None) -> list[int]:
+    """The scholar_indx values packed into hadiths.chain, in chain order"""
+    return json.loads(chain) if chain else []
+
+
+def insert_chains(
+    conn: sqlite3.Connection,
+    chains: pl.DataFrame,
+    hadith_ids: pl.DataFrame | None = None,
+) -> pl.DataFrame:
+    """Load chain links, into chain_links by hadith id when hadith_ids is given"""
+    if hadith_ids is None:
+        bulk_insert(conn, "hadith_chains", chains)
+        return chains
+
+    keys = ["source", "chapter_no", "hadith_no"]
+    linked = chains.join(
+        hadith_ids.rename({"id": "hadith_id"}), on=keys, how="inner", join_nulls=True
+    ).filter(pl.col("position").is_not_null())
+    if linked.height < chains.height:
+        print(
+            f"Dropped {chains.height - linked.height} chain links without a loaded "
+            "hadith or narrator"
+        )
+
+    bulk_insert(
+        conn, "chain_links", linked.select(["hadith_id", "position", "scholar_indx"])
+    )
+    return linked.drop("hadith_id")
+
+
+def insert_narrator_edges(
+    conn: sqlite3.Connection, chains: pl.DataFrame, explain: bool = False
+) -> None:
+    """Count the hadiths in which each narrator directly precedes another"""
+    keys = ["source", "chapter_no", "hadith_no", "position"]
+    edges = (
+        chains.lazy()
+        .join(
+            chains.lazy().with_columns(pl.col("position") - 1),
+            on=keys,
+            suffix="_to",
+        )
+        .group_by(
+            pl.col("scholar_indx").alias("from_indx"),
+            pl.col("scholar_indx_to").alias("to_indx"),
+            "source",
+        )
+        .agg(pl.len().alias("hadith_count"))
+    )
+
+    bulk_insert(conn, "narrator_edges", collect_stage("narrator_edges", edges, explain))
+
+
+def check_materialized(
+    conn: sqlite3.Connection, table: str, live_sql: str, table_sql: str
+) -> None:
+    """Fail the build if a precomputed table differs from the live query it replaces"""
+    missing = conn.execute(
+        f"SELECT COUNT(*) FROM ({live_sql} EXCEPT {table_sql})"
+    ).fetchone()[0]
+    unexpected = conn.execute(
+        f"SELECT COUNT(*) FROM ({table_sql} EXCEPT {live_sql})"
+    ).fetchone()[0]
+
+    if missing or unexpected:
+        raise ValueError(
+            f"{table} is out of sync with its base tables: "
+            f"{missing} rows missing, {unexpected} unexpected"
+        )
+    print(f"{table} matches its base tables")
+
+
+# Aggregates the pages would otherwise recompute on every request, as
+# (table, query over the base tables, indexed columns)
+STATS_TABLES = [
+    (
+        # getSourceChapters
+        "chapter_stats",
+        """
+        SELECT source, chapter, chapter_no, COUNT(*) AS count
+        FROM hadiths
+        GROUP BY source, chapter, chapter_no
+        """,
+        "source, chapter_no",
+    ),
+    (
+        # getNarratorStats, getNarratorsByGrade
+        "narrator_stats",
+        """
+        SELECT r.scholar_indx, COUNT(h.id) AS hadith_count,
+            GROUP_CONCAT(DISTINCT h.source) AS sources
+        FROM rawis r
+        LEFT JOIN hadith_chains c ON r.scholar_indx = c.scholar_indx
+        LEFT JOIN hadiths h ON c.source = h.source
+            AND c.chapter_no = h.chapter_no
+            AND c.hadith_no = h.hadith_no
+        GROUP BY r.scholar_indx
+        """,
+        "scholar_indx",
+    ),
+    (
+        # getNarratorsWithHadiths
+        "narrator_source_stats",
+        """
+        SELECT c.scholar_indx, h.source, COUNT(h.id) AS hadith_count
+        FROM hadith_chains c
+        JOIN hadiths h ON c.source = h.source
+            AND c.chapter_no = h.chapter_no
+            AND c.hadith_no = h.hadith_no
+        GROUP BY c.scholar_indx, h.source
+        """,
+        "source, scholar_indx",
+    ),
+    (
+        # getNarratorChapters
+        "narrator_chapter_stats",
+        """
+        SELECT c.scholar_indx, h.source, h.chapter, h.chapter_no,
+            COUNT(DISTINCT h.hadith_no) AS count
+        FROM hadith_chains c
+        JOIN hadiths h ON c.source = h.source
+            AND c.chapter_no = h.chapter_no
+            AND c.hadith_no = h.hadith_no
+        GROUP BY c.scholar_indx, h.source, h.chapter, h.chapter_no
+        """,
+        "scholar_indx, source, chapter_no",
+    ),
+]
+
+
+def create_stats_tables(conn: sqlite3.Connection) -> None:
+    """Materialize STATS_TABLES once the base tables and their indexes exist"""
+    for table, query, columns in STATS_TABLES:
+        start_time = time.perf_counter()
+        conn.execute(f"CREATE TABLE {table} AS {query}")
+        conn.execute(f"CREATE INDEX idx_{table} ON {table}({columns})")
+        rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        print(
+            f"Built {table} with {rows} rows in "
+            f"{time.perf_counter() - start_time:.2f}s"
+        )
 
-    chains.to_sql("hadith_chains", conn, if_exists="append", index=False)
+
+# A chain row counts when its hadith exists, as in the joins of STATS_TABLES
+LINKED_CHAINS = """
+    SELECT * FROM hadith_chains c
+    WHERE EXISTS (
+        SELECT 1 FROM hadiths h
+        WHERE h.source = c.source
+            AND h.chapter_no = c.chapter_no
+            AND h.hadith_no = c.hadith_no
+    )
+"""
+
+# Totals each stats table has to agree on, as (what is checked, totals from the base
+# tables or another stats table, the same totals from the stats table). None of them
+# repeats a STATS_TABLES query, so a wrong aggregate can't just agree with itself.
+STATS_CHECKS = [
+    (
+        "chapter_stats hadiths per source",
+        "SELECT source, COUNT(*) FROM hadiths GROUP BY source",
+        "SELECT source, SUM(count) FROM chapter_stats GROUP BY source",
+    ),
+    (
+        "narrator_stats narrators",
+        "SELECT scholar_indx FROM rawis",
+        "SELECT scholar_indx FROM narrator_stats",
+    ),
+    (
+        "narrator_stats hadiths per narrator",
+        """
+        SELECT scholar_indx, SUM(hadith_count)
+        FROM narrator_source_stats
+        GROUP BY scholar_indx
+        """,
+        "SELECT scholar_indx, hadith_count FROM narrator_stats WHERE hadith_count > 0",
+    ),
+    (
+        "narrator_source_stats chain rows per source",
+        f"SELECT source, COUNT(*) FROM ({LINKED_CHAINS}) GROUP BY source",
+        "SELECT source, SUM(hadith_count) FROM narrator_source_stats GROUP BY source",
+    ),
+    (
+        "narrator_chapter_stats hadiths per narrator and source",
+        f"""
+        SELECT scholar_indx, source, COUNT(*)
+        FROM (
+            SELECT DISTINCT scholar_indx, source, chapter_no, hadith_no
+            FROM ({LINKED_CHAINS})
+        )
+        GROUP BY scholar_indx, source
+        """,
+        """
+        SELECT scholar_indx, source, SUM(count)
+        FROM narrator_chapter_stats
+        GROUP BY scholar_indx, source
+        """,
+    ),
+]
+
+
+def check_stats_tables(conn: sqlite3.Connection) -> None:
+    for label, expected_sql, stats_sql in STATS_CHECKS:
+        check_materialized(conn, label, expected_sql, stats_sql)
+
+
+def check_narrator_edges(conn: sqlite3.Connection) -> None:
+    check_materialized(
+        conn,
+        "narrator_edges",
+        """
+        SELECT c1.scholar_indx, c2.scholar_indx, c1.source, COUNT(*)
+        FROM hadith_chains c1
+        JOIN hadith_chains c2 ON
+            c1.source = c2.source AND
+            c1.chapter_no = c2.chapter_no AND
+            c1.hadith_no = c2.hadith_no AND
+            c2.position = c1.position + 1
+        GROUP BY c1.scholar_indx, c2.scholar_indx, c1.source
+        """,
+        "SELECT from_indx, to_indx, source, hadith_count FROM narrator_edges",
+    )
+
+
+def check_packed_chains(conn: sqlite3.Connection) -> None:
+    check_materialized(
+        conn,
+        "hadiths.chain",
+        """
+        SELECT c.source, c.chapter_no, c.hadith_no, c.scholar_indx, c.position
+        FROM hadith_chains c
+        JOIN hadiths h ON c.source IS h.source
+            AND c.chapter_no IS h.chapter_no
+            AND c.hadith_no IS h.hadith_no
+        WHERE c.scholar_indx IS NOT NULL
+        """,
+        """
+        SELECT h.source, h.chapter_no, h.hadith_no, j.value, j.key + 1
+        FROM hadiths h, json_each(h.chain) j
+        """,
+    )
+
+
+def stage_inputs() -> dict[str, list[Path]]:
+    """Input files of each loading stage, in the order the stages run"""
+    return {
+        "rawis": [Path("data/rawis.csv"), Path("data/place_translations.json")],
+        "hadiths": [Path("data/hadiths_dataset.csv")]
+        + [
+            Path(f"data/{folder}/{name}")
+            for folder in SOURCE_FOLDERS
+            for name in ["explanations.csv", "matched_hadiths.csv"]
+        ],
+        "sources": [Path("data/scholars_sources.json")],
+    }
+
+
+# Tables and views each loading stage creates, which it drops before a rebuild
+STAGE_OBJECTS = {
+    "legacy": {
+        "rawis": ["rawis"],
+        "hadiths": ["hadiths", "hadith_chains", "narrator_edges"],
+        "sources": ["sources"],
+    },
+    "compact": {
+        "rawis": ["rawis"],
+        "hadiths": [
+            "hadiths",
+            "hadith_chains",
+            "collections",
+            "hadith_rows",
+            "chain_links",
+            "narrator_edges",
+        ],
+        "sources": ["sources"],
+    },
+}
+
+
+def file_hash(path: Path) -> str | None:
+    if not path.exists():
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def table_hash(conn: sqlite3.Connection, table: str) -> str:
+    """Digest of a table's rows that doesn't depend on their storage order"""
+    total = 0
+    for row in conn.execute(f"SELECT * FROM {table}"):
+        total += int.from_bytes(hashlib.sha256(repr(row).encode()).digest(), "big")
+    return f"{total % 2**256:064x}"
+
+
+def stage_outputs(conn: sqlite3.Connection, names: list[str]) -> dict[str, str]:
+    tables = [
+        name
+        for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"
+        )
+        if name in names
+    ]
+    return {table: table_hash(conn, table) for table in tables}
+
+
+def load_manifest() -> dict:
+    if not MANIFEST_PATH.exists():
+        return {}
+    with open(MANIFEST_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict) -> None:
+    tmp_path = MANIFEST_PATH.with_name(MANIFEST_PATH.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def drop_objects(conn: sqlite3.Connection, names: list[str]) -> None:
+    """Drop the named tables and views, with their indexes"""
+    for kind, name in conn.execute(
+        "SELECT type, name FROM sqlite_master WHERE type IN ('table', 'view')"
+    ).fetchall():
+        if name in names:
+            conn.execute(f"DROP {kind.upper()} {name}")
+
+
+def drop_derived(conn: sqlite3.Connection, schema: str) -> None:
+    """Drop everything built after the load, so it can be rebuilt over new data"""
+    for sql in SCHEMA_INDEXES[schema] + POST_LOAD_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {sql.split()[2]}")
+    for table in ["hadiths_fts", "rawis_fts"] + [t for t, _, _ in STATS_TABLES]:
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def load_hadiths(
+    conn: sqlite3.Connection,
+    hadiths_df: pl.LazyFrame,
+    schema: str = "legacy",
+    explain: bool = False,
+) -> None:
+    explanations = load_all_explanations(explain)
+    for collection in collection_names(hadiths_df):
+        # Build one collection at a time, so memory is bounded by the largest
+        # collection rather than the whole corpus
+        print(f"== {collection} ==")
+        unique_hadiths = collect_stage(
+            f"{collection} hadiths",
+            hadiths_df.filter(pl.col("source").str.strip_chars().eq_missing(collection))
+            # FIXME: these aren't actually duplicates, but something is wrong with the data.
+            # remove duplicates,
+            .unique(subset=["source", "chapter_no", "hadith_no"], keep="first"),
+            explain,
+        ).lazy()
+        chains = build_chains(unique_hadiths, explain)
+        hadith_ids = insert_hadiths(
+            conn, unique_hadiths, explanations, chains, schema, explain
+        )
+        chains = insert_chains(conn, chains, hadith_ids)
+        insert_narrator_edges(conn, chains, explain)
+
+
+def publish_database(path: Path) -> None:
+    """Finalize a built DB for read-only serving.
+
+    ANALYZE gives the planner sqlite_stat1, and VACUUM INTO rewrites the file compacted,
+    with PUBLISH_PAGE_SIZE pages and a rollback journal, so readers need no -wal/-shm
+    files and can map it read-only.
+    """
+    # bench_db imports from this module, so it can't be imported at the top
+    from scripts.bench_db import print_deltas, run_benchmarks
+
+    before = run_benchmarks(path, PUBLISH_BENCHMARKS, PUBLISH_SAMPLE_SIZE)
+
+    start_time = time.perf_counter()
+    published_path = path.with_name(path.name + ".published")
+    published_path.unlink(missing_ok=True)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.execute(f"PRAGMA page_size = {PUBLISH_PAGE_SIZE}")
+        conn.execute("VACUUM INTO ?", (str(published_path),))
+    finally:
+        conn.close()
+    print(f"Published in {time.perf_counter() - start_time:.2f}s")
+
+    after = run_benchmarks(published_path, PUBLISH_BENCHMARKS, PUBLISH_SAMPLE_SIZE)
+    print_deltas(path, published_path, before, after)
+    os.replace(published_path, path)
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate the SQLite database")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check the vectorized transforms against their reference implementations",
+    )
+    parser.add_argument(
+        "--schema",
+        choices=list(HADITH_TABLES),
+        default="legacy",
+        help="compact links chains to hadiths by integer id behind compatibility views",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Print the optimized query plan of each stage before running it",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild every stage, even if its inputs are unchanged",
+    )
+    parser.add_argument(
+        "--publish",
+        action="store_true",
+        help="Analyze and compact the DB for read-only serving, reporting size and latency",
+    )
+    args = parser.parse_args()
+
     # Ensure place_translations.json path is correct
     place_translations_path = Path("data/place_translations.json")
     if not place_translations_path.exists():
@@ -334,35 +1097,96 @@ def main() -> None:
         )
         print("Death place translations will not be applied.")
 
-    hadiths_df = pl.read_csv(Path("data/hadiths_dataset.csv"))
-    rawis_df = pl.read_csv(Path("data/rawis.csv"))
+    hadiths_df = pl.scan_csv(Path("data/hadiths_dataset.csv"))
+    rawis_df = pl.scan_csv(Path("data/rawis.csv"))
 
-    # FIXME: these aren't actually duplicates, but something is wrong with the data.
-    # remove duplicates,
-    unique_hadiths = hadiths_df.unique(
-        subset=["source", "chapter_no", "hadith_no"], keep="first"
-    )
+    if args.verify:
+        verify_clean_arabic_text(hadiths_df, rawis_df)
+
+    code = {"schema": args.schema, "publish": args.publish} | {
+        str(p): file_hash(p) for p in CODE_FILES
+    }
+    inputs = {
+        stage: {str(path): file_hash(path) for path in paths}
+        for stage, paths in stage_inputs().items()
+    }
+    previous = load_manifest()
+    reuse = not args.force and DB_PATH.exists() and previous.get("code") == code
+    previous_stages = previous.get("stages", {}) if reuse else {}
+    stale = [
+        stage
+        for stage in inputs
+        if previous_stages.get(stage, {}).get("inputs") != inputs[stage]
+    ]
+    if not stale:
+        print(f"{DB_PATH} is up to date with {MANIFEST_PATH}")
+        return
+    print(f"Building stages: {', '.join(stale)}")
+
+    # Build next to the live DB and rename it into place, so readers never see a
+    # half-written file
+    tmp_path = DB_PATH.with_name(DB_PATH.name + ".tmp")
+    if reuse:
+        shutil.copyfile(DB_PATH, tmp_path)
+    elif tmp_path.exists():
+        tmp_path.unlink()
 
-    db_path = Path("data/sqlite.db")
-    if db_path.exists():
-        db_path.unlink()
+    conn = sqlite3.connect(tmp_path)
+    apply_build_pragmas(conn)
 
-    conn = sqlite3.connect(db_path)
+    stages = {
+        "rawis": lambda: insert_rawis(conn, rawis_df, args.explain),
+        "hadiths": lambda: load_hadiths(conn, hadiths_df, args.schema, args.explain),
+        "sources": lambda: insert_sources(conn),
+    }
+    manifest = {"code": code, "stages": dict(previous_stages)}
 
     try:
-        create_tables(conn)
-        insert_hadiths(conn, unique_hadiths)
-        insert_rawis(conn, rawis_df)
-        insert_chains(conn, unique_hadiths)
-        insert_sources(conn)
+        if reuse:
+            drop_derived(conn, args.schema)
+            for stage in stale:
+                drop_objects(conn, STAGE_OBJECTS[args.schema][stage])
+        create_tables(conn, args.schema, stale)
+
+        for stage in stale:
+            stages[stage]()
+            manifest["stages"][stage] = {
+                "inputs": inputs[stage],
+                "outputs": stage_outputs(conn, STAGE_OBJECTS[args.schema][stage]),
+            }
+
+        changed = [
+            stage
+            for stage in stale
+            if previous_stages.get(stage, {}).get("outputs")
+            != manifest["stages"][stage]["outputs"]
+        ]
+        if changed:
+            create_indexes(conn, args.schema)
+            create_search_tables(conn)
+            create_stats_tables(conn)
+            check_narrator_edges(conn)
+            check_packed_chains(conn)
+            check_stats_tables(conn)
         conn.commit()
+        print(f"Peak RSS {peak_rss_mb():,.0f} MB")
 
     except Exception as e:
         conn.rollback()
+        conn.close()
+        tmp_path.unlink(missing_ok=True)
         raise e
 
-    finally:
-        conn.close()
+    conn.close()
+    if changed:
+        if args.publish:
+            publish_database(tmp_path)
+        os.replace(tmp_path, DB_PATH)
+        print(f"Wrote {DB_PATH}")
+    else:
+        tmp_path.unlink()
+        print(f"Rebuilt stages produced the same tables, keeping {DB_PATH}")
+    save_manifest(manifest)
 
 
 if __name__ == "__main__":
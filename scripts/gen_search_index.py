@@ -1,10 +1,29 @@
+import argparse
+import contextlib
+import hashlib
+import itertools
 import sqlite3
 import json
+import os
 import re
+import statistics
+import tempfile
+import time
+import zlib
+from collections import defaultdict
 from pathlib import Path
 
+import brotli
+
+from scripts.profiling import peak_rss_mb
+
 DB_PATH = Path("data/sqlite.db")
 OUT_PATH = Path("public/search_index.json")
+COLUMNAR_PATH = Path("public/search_index.columnar.json")
+SHARDS_DIR = Path("public/search")
+MANIFEST_PATH = SHARDS_DIR / "manifest.json"
+# Record hashes of the last sharded build, to find the shards that changed since
+STATE_PATH = Path("data/search_index.manifest.json")
 
 
 def normalize_whitespace(text):
@@ -25,33 +44,378 @@ def strip_diacritics(text):
     )
 
 
-def main():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # Fetch all hadiths from all sources
-    cursor.execute(
-        """
-        SELECT h.id, h.source, h.chapter, h.chapter_no, h.hadith_no, h.text_ar, r.name as narrator_name
-        FROM hadiths h
-        LEFT JOIN hadith_chains c ON h.source = c.source AND h.chapter_no = c.chapter_no AND h.hadith_no = c.hadith_no AND c.position = 1
-        LEFT JOIN rawis r ON c.scholar_indx = r.scholar_indx
-        """
-    )
-    rows = cursor.fetchall()
+HADITHS_QUERY = """
+    SELECT h.id, h.source, h.chapter, h.chapter_no, h.hadith_no, h.text_ar, r.name as narrator_name
+    FROM hadiths h
+    LEFT JOIN hadith_chains c ON h.source = c.source AND h.chapter_no = c.chapter_no AND h.hadith_no = c.hadith_no AND c.position = 1
+    LEFT JOIN rawis r ON c.scholar_indx = r.scholar_indx
+    """
+# Shards are written as the rows stream past, so each shard's rows have to be
+# contiguous: sources in order, then chapters by their lowest chapter_no
+SHARD_ORDER = """
+    COALESCE(h.source, ''),
+    MIN(COALESCE(h.chapter_no, 0)) OVER (PARTITION BY h.source, h.chapter),
+    COALESCE(h.chapter, ''),
+    h.id
+    """
+FETCH_BATCH_SIZE = 1000
+DICTIONARY_FIELDS = ["source", "chapter", "narrator_name"]
+
+
+def iter_hadiths(conn, stats, order_by="h.id"):
+    """Yield hadiths one by one, fetched in batches and normalized as they stream.
+
+    stats["rows"] counts the hadiths yielded so far.
+    """
+    cursor = conn.execute(f"{HADITHS_QUERY} ORDER BY {order_by}")
     columns = [desc[0] for desc in cursor.description]
-    all_hadiths = [dict(zip(columns, row)) for row in rows]
-    # Strip diacritics from text_ar in-place
-
-    # Normalize and clean text_ar and narrator_name
-    for h in all_hadiths:
-        h["text_ar"] = normalize_whitespace(strip_diacritics(h["text_ar"]))
-        if h.get("narrator_name"):
-            h["narrator_name"] = normalize_whitespace(
-                strip_diacritics(h["narrator_name"])
+    while rows := cursor.fetchmany(FETCH_BATCH_SIZE):
+        for row in rows:
+            h = dict(zip(columns, row))
+            # Normalize and clean text_ar and narrator_name
+            h["text_ar"] = normalize_whitespace(strip_diacritics(h["text_ar"]))
+            if h.get("narrator_name"):
+                h["narrator_name"] = normalize_whitespace(
+                    strip_diacritics(h["narrator_name"])
+                )
+            stats["rows"] += 1
+            yield h
+
+
+class CompressedOutput:
+    """A byte stream written to a file, with .gz and .br siblings unless compress is off.
+
+    The size of each variant is counted as it is written. Without a path nothing is
+    written, which measures a format without keeping it.
+    """
+
+    def __init__(self, path=None, compress=True):
+        self.compress = compress
+        if compress:
+            self.gzip = zlib.compressobj(9, zlib.DEFLATED, 31)
+            self.brotli = brotli.Compressor(quality=11)
+        self.sizes = {"raw": 0, "gzip": 0, "brotli": 0} if compress else {"raw": 0}
+        self.files = {}
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            suffixes = {"raw": "", "gzip": ".gz", "brotli": ".br"}
+            self.files = {
+                kind: open(f"{path}{suffixes[kind]}", "wb") for kind in self.sizes
+            }
+
+    def emit(self, kind, data):
+        self.sizes[kind] += len(data)
+        if kind in self.files:
+            self.files[kind].write(data)
+
+    def write(self, data):
+        self.emit("raw", data)
+        if self.compress:
+            self.emit("gzip", self.gzip.compress(data))
+            self.emit("brotli", self.brotli.process(data))
+
+    def close(self):
+        if self.compress:
+            self.emit("gzip", self.gzip.flush())
+            self.emit("brotli", self.brotli.finish())
+        for file in self.files.values():
+            file.close()
+
+
+def with_single(hadiths, output):
+    """Pass hadiths through, writing them to output as search_index.json.
+
+    The bytes match json.dumps(hadiths, ensure_ascii=False, indent=2), one record at
+    a time.
+    """
+    separator = "[\n  "
+    for h in hadiths:
+        record = json.dumps(h, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        output.write((separator + record).encode("utf-8"))
+        separator = ",\n  "
+        yield h
+    output.write(b"[]" if separator == "[\n  " else b"\n]")
+    output.close()
+
+
+def trigrams(text):
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def delta_encode(ids):
+    """Store ascending ids as gaps, which stay small and serialize short"""
+    return [current - previous for previous, current in zip([0] + ids, ids)]
+
+
+def build_postings(hadiths):
+    """Map each token and character trigram of the normalized text_ar to hadith ids.
+
+    Ids are positions in the shard. A query of three or more characters intersects the
+    postings of its trigrams; a shorter one unions those of the tokens containing it.
+    Either way only the returned hadiths need the substring check.
+    """
+    tokens, grams = defaultdict(list), defaultdict(list)
+    for local_id, h in enumerate(hadiths):
+        text = h["text_ar"] or ""
+        for token in set(text.split(" ")) - {""}:
+            tokens[token].append(local_id)
+        for gram in trigrams(text):
+            grams[gram].append(local_id)
+    return {
+        "tokens": {token: delta_encode(ids) for token, ids in sorted(tokens.items())},
+        "trigrams": {gram: delta_encode(ids) for gram, ids in sorted(grams.items())},
+    }
+
+
+def write_content_hashed(stem, payload):
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+    file_name = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}.json"
+    (SHARDS_DIR / file_name).write_bytes(data)
+    return file_name, len(data)
+
+
+def record_hash(h):
+    data = json.dumps(h, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def load_previous_build(code_hash):
+    """The previous manifest, and its shards by (source, chapter) with their record
+    hashes. Shards are only offered for reuse if this same code wrote them.
+    """
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        with open(STATE_PATH, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"version": 0, "shards": []}, {}
+
+    manifest.setdefault("version", 0)
+    if state.get("code") != code_hash:
+        return manifest, {}
+    return manifest, {
+        (shard["source"], shard["chapter"]): (
+            shard,
+            state["records"].get(shard["file"], []),
+        )
+        for shard in manifest["shards"]
+    }
+
+
+def save_state(code_hash, records):
+    tmp_path = STATE_PATH.with_name(STATE_PATH.name + ".tmp")
+    tmp_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"code": code_hash, "records": records}, f)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def slugify(text):
+    return re.sub(r"[^a-z0-9]+", "-", (text or "").lower()).strip("-") or "unknown"
+
+
+def write_shards(hadiths):
+    """Write one file per (source, chapter), named by a hash of its content.
+
+    The manifest lists the shards in chapter order, so the search page can offer the
+    chapters of a source and fetch only the shards its filters select. Shard names
+    change whenever their content does, so they can be cached indefinitely.
+
+    A shard whose record hashes match the previous build keeps its files untouched, so
+    only changed shards are serialized and get new names. The manifest's version only
+    goes up when its shard list changes, and it is left untouched otherwise.
+
+    Shard records leave out hadiths.id. gen_db renumbers it on every build, so one
+    added or deleted hadith would shift the ids, and so the content, of every later
+    shard. Files are named after the source and their content alone, so an incremental
+    build names them exactly as a full one does.
+
+    hadiths must arrive in SHARD_ORDER; only one shard is held in memory at a time.
+    """
+    code_hash = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+    previous_manifest, previous = load_previous_build(code_hash)
+    SHARDS_DIR.mkdir(parents=True, exist_ok=True)
+    manifest = {"version": previous_manifest["version"], "shards": []}
+    records, seen = {}, set()
+    changes = {"rewritten": 0, "added": 0, "dropped": 0}
+    for key, group in itertools.groupby(
+        hadiths, key=lambda h: (h["source"], h["chapter"])
+    ):
+        shard = [{k: v for k, v in h.items() if k != "id"} for h in group]
+        hashes = [record_hash(h) for h in shard]
+        entry, old_hashes = previous.get(key, (None, []))
+        seen.add(key)
+        if (
+            entry is None
+            or hashes != old_hashes
+            or not (SHARDS_DIR / entry["file"]).exists()
+            or not (SHARDS_DIR / entry["postings"]).exists()
+        ):
+            source, chapter = key
+            stem = slugify(source)
+            file_name, size = write_content_hashed(stem, shard)
+            index_name, index_size = write_content_hashed(
+                f"{stem}.postings", build_postings(shard)
             )
+            entry = {
+                "source": source,
+                "chapter": chapter,
+                "count": len(shard),
+                "bytes": size,
+                "file": file_name,
+                "postings_bytes": index_size,
+                "postings": index_name,
+            }
+            changes["rewritten"] += 1
+            changes["added"] += len(set(hashes) - set(old_hashes))
+            changes["dropped"] += len(set(old_hashes) - set(hashes))
+        manifest["shards"].append(entry)
+        records[entry["file"]] = hashes
+    for key, (_, old_hashes) in previous.items():
+        if key not in seen:
+            changes["dropped"] += len(old_hashes)
+
+    # Drop shards of earlier builds that the new manifest no longer references
+    current = {shard["file"] for shard in manifest["shards"]} | {
+        shard["postings"] for shard in manifest["shards"]
+    }
+    for path in SHARDS_DIR.glob("*.json"):
+        if path != MANIFEST_PATH and path.name not in current:
+            path.unlink()
+
+    if manifest["shards"] != previous_manifest["shards"]:
+        manifest["version"] += 1
+        with open(MANIFEST_PATH, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+    save_state(code_hash, records)
+
+    print(
+        f"Manifest version {manifest['version']}: rewrote {changes['rewritten']} of "
+        f"{len(manifest['shards'])} shards; {changes['added']} record hashes added, "
+        f"{changes['dropped']} dropped"
+    )
+    return manifest
+
+
+def report_shards(manifest, single_size):
+    """Print shard sizes and the bytes the search page downloads per filter"""
+    sizes = [shard["bytes"] for shard in manifest["shards"]]
+    manifest_size = MANIFEST_PATH.stat().st_size
+    print(
+        f"Wrote {len(sizes)} shards to {SHARDS_DIR}: {sum(sizes):,} bytes in total, "
+        f"min {min(sizes):,}, median {statistics.median(sizes):,.0f}, "
+        f"max {max(sizes):,}; manifest {manifest_size:,} bytes"
+    )
+    print(
+        "Postings: "
+        f"{sum(shard['postings_bytes'] for shard in manifest['shards']):,} bytes, "
+        "fetched only once a text query is typed"
+    )
+    print(f"Single search_index.json: {single_size:,} bytes")
+
+    by_source = {}
+    for shard in manifest["shards"]:
+        by_source.setdefault(shard["source"], []).append(shard["bytes"])
+    for source, source_sizes in by_source.items():
+        print(
+            f"{source}: all chapters {manifest_size + sum(source_sizes):,} bytes, "
+            f"one chapter median {manifest_size + statistics.median(source_sizes):,.0f} "
+            f"/ max {manifest_size + max(source_sizes):,} bytes"
+        )
+
+
+def write_columnar(hadiths, output):
+    """Store the index as one list per field instead of one dict per hadith.
+
+    Source, chapter and narrator names repeat across thousands of hadiths, so they are
+    dictionary-encoded: each is stored once in a table, and its column holds indices
+    into that table (null stays null). Columns are spooled to temporary files while
+    the hadiths stream past, then copied to output after the tables.
+    """
+    tables = {field: {} for field in DICTIONARY_FIELDS}
+    spools = {}
+    with contextlib.ExitStack() as stack:
+        for h in hadiths:
+            if not spools:
+                spools = {
+                    field: stack.enter_context(tempfile.TemporaryFile()) for field in h
+                }
+            for field, spool in spools.items():
+                value = h[field]
+                if field in tables and value is not None:
+                    value = tables[field].setdefault(value, len(tables[field]))
+                if spool.tell():
+                    spool.write(b",")
+                spool.write(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+        head = json.dumps(
+            {field: list(values) for field, values in tables.items()},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        output.write(f'{{"tables":{head},"columns":{{'.encode("utf-8"))
+        for i, (field, spool) in enumerate(spools.items()):
+            output.write(f'{"," if i else ""}{json.dumps(field)}:['.encode("utf-8"))
+            spool.seek(0)
+            while chunk := spool.read(1 << 20):
+                output.write(chunk)
+            output.write(b"]")
+        output.write(b"}}")
+    output.close()
+
 
-    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(all_hadiths, f, ensure_ascii=False, indent=2)
-    print(f"Exported {len(all_hadiths)} hadiths to {OUT_PATH}")
+def report_formats(formats):
+    """Print raw and compressed sizes of each format, relative to the first"""
+    baseline = formats[0][1]
+    print(f"{'format':<10}{'raw':>20}{'gzip':>20}{'brotli':>20}")
+    for name, sizes in formats:
+        cells = [
+            f"{sizes[kind]:,} ({sizes[kind] / baseline[kind]:.0%})"
+            for kind in ("raw", "gzip", "brotli")
+        ]
+        print(f"{name:<10}" + "".join(f"{cell:>20}" for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the hadith search index")
+    parser.add_argument(
+        "--layout",
+        choices=["sharded", "single", "columnar"],
+        default="sharded",
+        help="sharded writes a manifest plus one file per source and chapter; "
+        "columnar writes one dictionary-encoded file with .gz/.br siblings",
+    )
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(DB_PATH)
+    stats = {"rows": 0}
+    start_time = time.perf_counter()
+    if args.layout == "single":
+        out_path = OUT_PATH
+        for _ in with_single(
+            iter_hadiths(conn, stats), CompressedOutput(OUT_PATH, compress=False)
+        ):
+            pass
+    elif args.layout == "columnar":
+        out_path = COLUMNAR_PATH
+        single = CompressedOutput()
+        columnar = CompressedOutput(COLUMNAR_PATH)
+        write_columnar(with_single(iter_hadiths(conn, stats), single), columnar)
+        report_formats([("single", single.sizes), ("columnar", columnar.sizes)])
+    else:
+        out_path = MANIFEST_PATH
+        single = CompressedOutput(compress=False)
+        manifest = write_shards(
+            with_single(iter_hadiths(conn, stats, order_by=SHARD_ORDER), single)
+        )
+        report_shards(manifest, single.sizes["raw"])
+    conn.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"Exported {stats['rows']} hadiths to {out_path} in {elapsed:.2f}s "
+        f"({stats['rows'] / max(elapsed, 1e-9):,.0f} rows/s, peak RSS {peak_rss_mb():,.0f} MB)"
+    )
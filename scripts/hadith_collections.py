@@ -0,0 +1,7 @@
+# Collections with scraped explanations, as data/<folder> -> source name. map_data
+# matches each of them and gen_db merges the matches written for every entry, so a new
+# collection only needs a line here.
+SOURCE_FOLDERS = {
+    "bukhari": "Sahih Bukhari",
+    "muslim": "Sahih Muslim",
+}
@@ -1,6 +1,29 @@
+import argparse
+import concurrent.futures
 import csv
-from rapidfuzz import fuzz
+import hashlib
+import heapq
+import json
 import os
+import random
+import time
+from collections import Counter, defaultdict
+from functools import partial
+
+import numpy as np
+import polars as pl
+from rapidfuzz import fuzz, process
+
+from scripts.gen_search_index import normalize_whitespace, strip_diacritics
+from scripts.hadith_collections import SOURCE_FOLDERS
+from scripts.profiling import peak_rss_mb
+
+MATCH_THRESHOLD = 65
+NGRAM_SIZE = 3
+SHORTLIST_SIZE = 20
+BLOCK_MB = 256
+ALIGN_WINDOW = 40
+CANDIDATE_COUNT = 5
 
 
 # Function to read and parse open_hadiths.csv (no headers)
@@ -11,12 +34,20 @@ def read_open_hadiths(file_path):
     return open_hadiths
 
 
-# Function to read and parse hadiths.csv (with headers)
-def read_hadiths(file_path):
-    with open(file_path, "r", encoding="utf-8") as file:
-        reader = csv.DictReader(file)
-        hadiths = [row for row in reader]
-    return hadiths
+# Function to read hadiths_dataset.csv once and split it by source
+def read_hadiths_by_source(file_path, sources):
+    # Every column stays a string, exactly as csv.DictReader would return it
+    hadiths = (
+        pl.scan_csv(file_path, infer_schema=False, missing_utf8_is_empty_string=True)
+        .select("id", pl.col("source").str.strip_chars(), "hadith_no", "text_ar")
+        .filter(pl.col("source").is_in(sources))
+        .collect()
+    )
+    partitions = hadiths.partition_by("source", as_dict=True, include_key=False)
+    return {
+        source: partitions.get((source,), hadiths.clear().drop("source"))
+        for source in sources
+    }
 
 
 # Function to read and parse explanations.csv (no headers)
@@ -27,50 +58,327 @@ def read_explanations(file_path):
     return explanations
 
 
-# Function to filter Hadiths by source
-def filter_hadiths_by_source(hadiths, source):
-    # Strip leading/trailing spaces from column names and values
-    filtered_hadiths = []
-    for h in hadiths:
-        # Ensure the 'source' column exists and strip spaces
-        if "source" in h:
-            h_source = h["source"].strip()
-            if h_source == source:
-                filtered_hadiths.append(h)
+def normalize_text(text):
+    return normalize_whitespace(strip_diacritics(text or ""))
+
+
+def char_ngrams(text, n=NGRAM_SIZE):
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+class NgramIndex:
+    """Inverted index from character n-grams of the normalized text_ar to hadith positions"""
+
+    def __init__(self, hadiths, n=NGRAM_SIZE):
+        self.n = n
+        self.postings = defaultdict(list)
+        self.sizes = []
+        for i, h in enumerate(hadiths):
+            grams = char_ngrams(normalize_text(h["text_ar"]), n)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(i)
+
+    def candidates(self, text, k=SHORTLIST_SIZE):
+        """Return the positions of the k hadiths sharing the most n-grams with text (Dice coefficient)"""
+        grams = char_ngrams(normalize_text(text), self.n)
+        overlap = Counter()
+        for gram in grams:
+            overlap.update(self.postings.get(gram, ()))
+        scores = {
+            i: 2 * count / (len(grams) + self.sizes[i]) for i, count in overlap.items()
+        }
+        shortlist = sorted(scores, key=scores.get, reverse=True)[:k]
+        # Score in corpus order so ties resolve the same way as the exhaustive scan
+        return sorted(shortlist)
+
+
+def has_explanation(oh_id, explanations):
+    return oh_id in explanations and explanations[oh_id].strip()
+
+
+def find_best_match(oh_text, hadiths, candidates):
+    """Return the position and score of the best scoring candidate, or None if all score 0"""
+    best_index = None
+    best_score = 0
+
+    for i in candidates:
+        score = fuzz.ratio(oh_text, hadiths[i]["text_ar"])
+        if score > best_score:
+            best_score = score
+            best_index = i
+
+    return best_index, best_score
+
+
+def rank_matches(scored, k=CANDIDATE_COUNT):
+    """Return the k best (position, score) pairs scoring above 0, best first.
+
+    Ties go to the lowest position, so the first pair is the one find_best_match picks
+    when the candidates are in corpus order.
+    """
+    ranked = heapq.nsmallest(k, ((-score, i) for i, score in scored if score > 0))
+    return [(i, -neg_score) for neg_score, i in ranked]
+
+
+def top_matches(oh_text, hadiths, candidates, k=CANDIDATE_COUNT):
+    """Return the k best scoring candidates as (position, score) pairs, best first"""
+    return rank_matches(
+        ((i, fuzz.ratio(oh_text, hadiths[i]["text_ar"])) for i in candidates), k
+    )
+
+
+def score_exhaustive(texts, hadiths):
+    """Score every open hadith text against every hadith, one pair at a time"""
+    all_candidates = range(len(hadiths))
+    for text in texts:
+        yield top_matches(text, hadiths, all_candidates)
+
+
+def score_ngram(texts, hadiths, index=None, top_k=SHORTLIST_SIZE):
+    """Score every open hadith text against its n-gram shortlist only"""
+    index = index or NgramIndex(hadiths)
+    for text in texts:
+        yield top_matches(text, hadiths, index.candidates(text, top_k))
+
+
+def score_batched(texts, hadiths, block_mb=BLOCK_MB):
+    """Score blocks of open hadith texts against all hadiths as a score matrix on all cores.
+
+    Scores are kept as float64 and the first maximum of each row is always among the
+    candidates, so the result is the same as the exhaustive scan.
+    """
+    if not hadiths:
+        yield from ([] for _ in texts)
+        return
+
+    choices = [h["text_ar"] for h in hadiths]
+    block_size = max(1, block_mb * 1024 * 1024 // (8 * len(choices)))
+
+    for start in range(0, len(texts), block_size):
+        scores = process.cdist(
+            texts[start : start + block_size],
+            choices,
+            scorer=fuzz.ratio,
+            dtype=np.float64,
+            workers=-1,
+        )
+        k = min(CANDIDATE_COUNT, len(choices))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for row, best, positions in zip(scores, scores.argmax(axis=1), top):
+            positions = {int(best), *map(int, positions)}
+            yield rank_matches(((j, float(row[j])) for j in positions), k)
+
+
+def score_aligned(
+    texts, hadiths, window=ALIGN_WINDOW, fallback=score_exhaustive, cache=None
+):
+    """Align open hadith texts with the hadiths, relying on both being in book order.
+
+    Each text is scored only against a window of hadiths starting just behind the hadith
+    that follows the previous anchored match, which keeps matching near-linear and stops
+    it from jumping to a near-identical hadith in a distant chapter. Texts that find no
+    match above the threshold in their window are searched globally with the fallback
+    engine, and a fallback match re-anchors the window.
+
+    A result depends on the window as well as the text, so a cache (text hash ->
+    [candidates, cursor]) is used here rather than by score_cached: a cached result is
+    only reused when the alignment reaches the text at the same cursor, which gives the
+    same matches as an uncached run. The cache is updated in place and pruned to the
+    current texts.
+    """
+    cursor = 0
+    slack = window // 4
+    keys, scored = [], 0
+
+    for text in texts:
+        key = text_hash(text) if cache is not None else None
+        entry = cache.get(key) if cache is not None else None
+        if entry is not None and entry[1] == cursor:
+            matches = entry[0]
         else:
-            raise KeyError("The 'source' column is missing in the Hadiths file.")
-    return filtered_hadiths
+            scored += 1
+            candidates = range(
+                max(0, cursor - slack), min(len(hadiths), cursor + window)
+            )
+            matches = top_matches(text, hadiths, candidates)
+
+            if not matches or matches[0][1] <= MATCH_THRESHOLD:
+                matches = next(fallback([text], hadiths))
+
+            if cache is not None:
+                cache[key] = [matches, cursor]
+        keys.append(key)
 
+        if matches and matches[0][1] > MATCH_THRESHOLD:
+            cursor = matches[0][0] + 1
 
-def match_hadiths(open_hadiths, hadiths, explanations):
-    matched = []
-    unmatched_hadiths = hadiths.copy()
+        yield matches
 
-    for oh in open_hadiths:
-        oh_id = oh[0]
-        oh_text = oh[1]
+    if cache is not None:
+        print(f"Scored {scored} open hadiths, {len(texts) - scored} cached")
+        prune_cache(cache, keys)
 
-        if oh_id not in explanations or not explanations[oh_id].strip():
+
+MATCH_ENGINES = {
+    "exhaustive": score_exhaustive,
+    "ngram": score_ngram,
+    "batched": score_batched,
+    "aligned": score_aligned,
+}
+
+
+def assign_first(texts, hadiths, matches):
+    """Give every text its best match, even if another text already claimed it"""
+    return {
+        i: candidates[0][0]
+        for i, candidates in enumerate(matches)
+        if candidates and candidates[0][1] > MATCH_THRESHOLD
+    }
+
+
+def assign_greedy(texts, hadiths, matches):
+    """Assign texts to hadiths one-to-one, highest scoring pair first.
+
+    When a text's hadith is already taken, its next candidate from the scorer is pushed
+    back onto the heap, so only the pairs the engine scored are resolved. Only a text
+    whose CANDIDATE_COUNT candidates all scored above the threshold and were all taken
+    is re-scored, against every free hadith.
+    """
+    heap = [
+        (-candidates[0][1], i, 0, candidates[0][0])
+        for i, candidates in enumerate(matches)
+        if candidates and candidates[0][1] > MATCH_THRESHOLD
+    ]
+    heapq.heapify(heap)
+    assignment = {}
+    taken = set()
+
+    while heap:
+        _, i, rank, best_index = heapq.heappop(heap)
+        if best_index not in taken:
+            assignment[i] = best_index
+            taken.add(best_index)
             continue
 
-        best_match = None
-        best_score = 0
+        candidates = matches[i]
+        rank += 1
+        if rank < len(candidates):
+            best_index, best_score = candidates[rank]
+        elif len(candidates) >= CANDIDATE_COUNT:
+            free = (j for j in range(len(hadiths)) if j not in taken)
+            best_index, best_score = find_best_match(texts[i], hadiths, free)
+        else:
+            continue
+        if best_index is not None and best_score > MATCH_THRESHOLD:
+            heapq.heappush(heap, (-best_score, i, rank, best_index))
+
+    return assignment
+
 
-        for h in hadiths:
-            score = fuzz.ratio(oh_text, h["text_ar"])
-            if score > best_score:
-                best_score = score
-                best_match = h
+ASSIGNMENTS = {
+    "first": assign_first,
+    "greedy": assign_greedy,
+}
 
-        if best_match and best_score > 65:
-            # Store both id and hadith_no
-            matched.append((oh_id, best_match["id"], best_match["hadith_no"]))
-            if best_match in unmatched_hadiths:
-                unmatched_hadiths.remove(best_match)
+
+def match_hadiths(
+    open_hadiths, hadiths, explanations, scorer=score_exhaustive, assign=assign_first
+):
+    explained = [oh for oh in open_hadiths if has_explanation(oh[0], explanations)]
+    texts = [oh[1] for oh in explained]
+    assignment = assign(texts, hadiths, list(scorer(texts, hadiths)))
+
+    # Store both id and hadith_no
+    matched = [
+        (oh[0], hadiths[assignment[i]]["id"], hadiths[assignment[i]]["hadith_no"])
+        for i, oh in enumerate(explained)
+        if i in assignment
+    ]
+    claimed = set(assignment.values())
+    unmatched_hadiths = [h for j, h in enumerate(hadiths) if j not in claimed]
 
     return matched, unmatched_hadiths
 
 
+def audit_shortlist(open_hadiths, hadiths, explanations, index, top_k, sample_size):
+    """Compare the n-gram shortlist against the exhaustive scan on a sample of open hadiths.
+
+    Returns the number of sampled hadiths and how many of them ended up with a different match.
+    """
+    explained = [oh for oh in open_hadiths if has_explanation(oh[0], explanations)]
+    sample = random.Random(0).sample(explained, min(sample_size, len(explained)))
+    missed = 0
+
+    for oh in sample:
+        expected, expected_score = find_best_match(oh[1], hadiths, range(len(hadiths)))
+        found, found_score = find_best_match(
+            oh[1], hadiths, index.candidates(oh[1], top_k)
+        )
+        if expected_score <= MATCH_THRESHOLD:
+            expected = None
+        if found_score <= MATCH_THRESHOLD:
+            found = None
+        if expected != found:
+            missed += 1
+
+    return len(sample), missed
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def corpus_version(hadiths):
+    """Hash the candidate corpus, since cached matches refer to positions within it"""
+    digest = hashlib.sha256()
+    for h in hadiths:
+        for field in ("id", "hadith_no", "text_ar"):
+            digest.update(str(h[field]).encode("utf-8"))
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def load_match_cache(file_path, version):
+    """Load cached candidates (open hadith text hash -> [[position, score], ...]) for this corpus version"""
+    try:
+        with open(file_path, "r", encoding="utf-8") as file:
+            cache = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+    if cache.get("version") != version:
+        return {}
+    return cache["matches"]
+
+
+def save_match_cache(file_path, version, matches):
+    with open(file_path, "w", encoding="utf-8") as file:
+        json.dump({"version": version, "matches": matches}, file)
+
+
+def prune_cache(cache, keys):
+    for key in set(cache) - set(keys):
+        del cache[key]
+
+
+def score_cached(texts, hadiths, cache, scorer):
+    """Reuse cached results and only score the texts that are new or changed.
+
+    The cache is updated in place and pruned to the current texts. Only for engines
+    that score each text on its own; score_aligned does its own caching.
+    """
+    keys = [text_hash(text) for text in texts]
+    missing = [i for i, key in enumerate(keys) if key not in cache]
+    print(f"Scoring {len(missing)} open hadiths, {len(texts) - len(missing)} cached")
+
+    for i, matches in zip(missing, scorer([texts[i] for i in missing], hadiths)):
+        cache[keys[i]] = matches
+
+    prune_cache(cache, keys)
+    return [cache[key] for key in keys]
+
+
 def write_matched(matched, file_path):
     with open(file_path, "w", encoding="utf-8", newline="") as file:
         writer = csv.writer(file)
@@ -87,46 +395,180 @@ def write_unmatched(unmatched, file_path):
 
 
 # Function to process a single source
-def process_source(source, folder_name, data_dir):
+def process_source(
+    source,
+    folder_name,
+    data_dir,
+    hadiths,
+    engine="exhaustive",
+    top_k=SHORTLIST_SIZE,
+    block_mb=BLOCK_MB,
+    window=ALIGN_WINDOW,
+    audit=0,
+    use_cache=True,
+    assignment="first",
+):
+    start_time = time.perf_counter()
+
     # Define file paths
-    hadiths_dataset_path = os.path.join(data_dir, "hadiths_dataset.csv")
     open_hadiths_path = os.path.join(data_dir, folder_name, "hadiths.csv")
     explanations_path = os.path.join(data_dir, folder_name, "explanations.csv")
     matched_path = os.path.join(data_dir, folder_name, "matched_hadiths.csv")
     unmatched_path = os.path.join(data_dir, folder_name, "unmatched_hadiths.csv")
+    cache_path = os.path.join(data_dir, folder_name, "match_cache.json")
 
     # Read data
     open_hadiths = read_open_hadiths(open_hadiths_path)
     explanations = read_explanations(explanations_path)
-    hadiths_dataset = read_hadiths(hadiths_dataset_path)
 
-    # Filter Hadiths by source
-    filtered_hadiths = filter_hadiths_by_source(hadiths_dataset, source)
+    # The matchers look rows up by position, so only this source's rows become dicts
+    filtered_hadiths = hadiths.to_dicts()
+
+    # Pick the scoring engine
+    index = None
+    if engine == "ngram":
+        index = NgramIndex(filtered_hadiths)
+        scorer = partial(score_ngram, index=index, top_k=top_k)
+    elif engine == "batched":
+        scorer = partial(score_batched, block_mb=block_mb)
+    elif engine == "aligned":
+        scorer = partial(score_aligned, window=window)
+    else:
+        scorer = MATCH_ENGINES[engine]
+
+    # Reuse matches of open hadiths whose text and candidate corpus did not change
+    if use_cache:
+        version = (
+            f"{engine}:{top_k}:{window}:{CANDIDATE_COUNT}:"
+            f"{corpus_version(filtered_hadiths)}"
+        )
+        cache = load_match_cache(cache_path, version)
+        if engine == "aligned":
+            scorer = partial(score_aligned, window=window, cache=cache)
+        else:
+            scorer = partial(score_cached, cache=cache, scorer=scorer)
 
     # Match Hadiths
-    matched, unmatched = match_hadiths(open_hadiths, filtered_hadiths, explanations)
+    matched, unmatched = match_hadiths(
+        open_hadiths,
+        filtered_hadiths,
+        explanations,
+        scorer=scorer,
+        assign=ASSIGNMENTS[assignment],
+    )
 
     # Write results
     write_matched(matched, matched_path)
     write_unmatched(unmatched, unmatched_path)
+    if use_cache:
+        save_match_cache(cache_path, version, cache)
 
     print(f"Processed {source}: {len(matched)} matches, {len(unmatched)} unmatched")
 
+    if index is not None and audit:
+        checked, missed = audit_shortlist(
+            open_hadiths, filtered_hadiths, explanations, index, top_k, audit
+        )
+        print(
+            f"Shortlist audit for {source}: {missed}/{checked} "
+            f"({missed / max(checked, 1):.1%}) differ from the exhaustive match"
+        )
+
+    # Every source runs in its own process, so this is the peak of this source alone
+    return time.perf_counter() - start_time, peak_rss_mb()
+
 
 # Main function
 def main():
-    # Define folder names and their corresponding sources
-    source_mapping = {
-        "bukhari": "Sahih Bukhari",
-        "muslim": "Sahih Muslim",
-    }
+    parser = argparse.ArgumentParser(
+        description="Match open hadiths with the hadiths dataset"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=list(MATCH_ENGINES),
+        default="exhaustive",
+        help="Score every hadith pair by pair (exhaustive), only an n-gram shortlist "
+        "(ngram), as blocked score matrices on all cores (batched) or within a window "
+        "that follows book order (aligned)",
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=SHORTLIST_SIZE,
+        help="Number of candidates the n-gram index returns per open hadith",
+    )
+    parser.add_argument(
+        "--block-mb",
+        type=int,
+        default=BLOCK_MB,
+        help="Memory budget in MB for each score matrix of the batched engine",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=ALIGN_WINDOW,
+        help="Number of hadiths the aligned engine scores around the expected position",
+    )
+    parser.add_argument(
+        "--assignment",
+        choices=list(ASSIGNMENTS),
+        default="first",
+        help="Let every open hadith take its best match (first) or assign matches "
+        "one-to-one by descending score (greedy)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-score every open hadith instead of reusing match_cache.json",
+    )
+    parser.add_argument(
+        "--audit",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Re-match N sampled open hadiths exhaustively and report shortlist misses",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of sources to match in parallel (default: one process per source)",
+    )
+    args = parser.parse_args()
 
     # Define data directory
     data_dir = "data"
 
-    # Process each source
-    for folder_name, source in source_mapping.items():
-        process_source(source, folder_name, data_dir)
+    # Read the dataset once and hand every source its own partition
+    hadiths_by_source = read_hadiths_by_source(
+        os.path.join(data_dir, "hadiths_dataset.csv"), list(SOURCE_FOLDERS.values())
+    )
+
+    # Process each source in its own process
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.jobs or len(SOURCE_FOLDERS), max_tasks_per_child=1
+    ) as executor:
+        futures = {
+            executor.submit(
+                process_source,
+                source,
+                folder_name,
+                data_dir,
+                hadiths_by_source[source],
+                engine=args.engine,
+                top_k=args.top_k,
+                block_mb=args.block_mb,
+                window=args.window,
+                audit=args.audit,
+                use_cache=not args.no_cache,
+                assignment=args.assignment,
+            ): source
+            for folder_name, source in SOURCE_FOLDERS.items()
+        }
+
+        for future in concurrent.futures.as_completed(futures):
+            elapsed, peak_mb = future.result()
+            print(f"{futures[future]}: {elapsed:.1f}s wall, {peak_mb:.0f} MB peak")
 
 
 if __name__ == "__main__":
@@ -1,11 +1,13 @@
 import {
   close,
+  decodeChain,
   getChainForHadith,
   getHadithById,
   getHadiths,
   getHadithsFromNarratorToNarrator,
   getNarratorPairs,
   getNarrators,
+  searchHadiths,
 } from "../lib/sqlite";
 import { afterAll, describe, expect, test } from "bun:test";
 
@@ -138,6 +140,14 @@ describe("Hadith 6800 retrieval", () => {
     });
   });
 
+  test("packed chain matches the chain for 1:2", () => {
+    const hadith = getHadithById("Sahih Bukhari", "كتاب بدء الوحى", "2");
+    const chain = getChainForHadith("Sahih Bukhari", "كتاب بدء الوحى", "2");
+    expect(decodeChain(hadith!.chain)).toStrictEqual(
+      chain.map((narrator) => narrator.scholar_indx),
+    );
+  });
+
   test("getHadithsFromNarratorToNarrator returns hadiths narrated from one narrator to another", () => {
     // First get some narrators to test with
     const narrators = getNarrators();
@@ -186,6 +196,26 @@ describe("Hadith 6800 retrieval", () => {
     });
   });
 
+  test("searchHadiths returns ranked full-text matches with snippets", () => {
+    const results = searchHadiths("رسول الله", 10);
+    expect(results).toBeArray();
+    expect(results.length).toBeGreaterThan(0);
+    expect(results.length).toBeLessThanOrEqual(10);
+    results.forEach((result) => {
+      expect(result).toHaveProperty("hadith_no");
+      expect(result.snippet).toContain("<mark>");
+    });
+
+    // bm25() is lower for better matches
+    for (let i = 1; i < results.length; i++) {
+      expect(results[i].rank).toBeGreaterThanOrEqual(results[i - 1].rank);
+    }
+  });
+
+  test("searchHadiths ignores blank queries", () => {
+    expect(searchHadiths("   ")).toHaveLength(0);
+  });
+
   afterAll(() => {
     close();
   });